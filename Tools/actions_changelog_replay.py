@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+
+"""
+Replays actions_changelogs_since_last_run.py offline, against a local stand-in for the GitHub API and a Discord webhook.
+
+The fake GitHub serves the current workflow run, paginated past runs and the previous Changelog.yml. The fake webhook
+enforces a rate limit bucket like Discord's, with or without the X-RateLimit headers. For every changelog size, the
+publisher is run as it would be in the publish workflow, once without publish state (so it uses the GitHub API) and
+once with it, and the time taken and requests made are reported.
+"""
+
+import argparse
+import http.server
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from pathlib import Path
+
+import yaml
+
+import actions_changelogs_since_last_run as publisher
+
+REPOSITORY = "space-wizards/space-station-14"
+CURRENT_RUN_ID = 1000
+WORKFLOW_ID = 1
+LAST_SHA = "0123456789abcdef0123456789abcdef01234567"
+
+AUTHORS = ["PJB3005", "DrSmugleaf", "slarticodefast", "B_Kirill", "mnva0", "whatston3", "jessicamaybe"]
+WORDS = "the a station crew clown borg chemist fixed added removed now can no longer properly when with of".split()
+
+
+class FakeServer:
+    """
+    Local HTTP server standing in for the GitHub API and a Discord webhook. Counts every request it gets.
+    """
+
+    def __init__(self, old_changelog: str, runs: int, page_size: int, bucket_size: int, bucket_reset: float,
+                 rate_limit_headers: bool):
+        self.old_changelog = old_changelog
+        self.runs = runs
+        self.page_size = page_size
+        self.bucket_size = bucket_size
+        self.bucket_reset = bucket_reset
+        self.rate_limit_headers = rate_limit_headers
+
+        self.lock = threading.Lock()
+        self.requests: dict[str, int] = {}
+        self.messages: list[str] = []
+        self.remaining = bucket_size
+        self.reset_at = 0.0
+
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), self.make_handler())
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self) -> "FakeServer":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def count(self, name: str):
+        with self.lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+
+    def make_handler(self):
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                url = urllib.parse.urlsplit(self.path)
+                query = urllib.parse.parse_qs(url.query)
+                prefix = f"/repos/{REPOSITORY}"
+
+                if url.path == f"{prefix}/actions/runs/{CURRENT_RUN_ID}":
+                    server.count("github run")
+                    self.send_json(200, server.run_json(CURRENT_RUN_ID))
+                elif url.path == f"{prefix}/actions/workflows/{WORKFLOW_ID}/runs":
+                    server.count("github runs page")
+                    self.send_runs_page(url.path, int(query.get("page", ["1"])[0]))
+                elif url.path == f"{prefix}/contents/{publisher.CHANGELOG_FILE}":
+                    server.count("github contents")
+                    self.send_body(200, server.old_changelog.encode("utf-8"), "text/plain; charset=utf-8")
+                else:
+                    server.count("unknown")
+                    self.send_json(404, {"message": "Not Found"})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if urllib.parse.urlsplit(self.path).path != "/webhook":
+                    server.count("unknown")
+                    self.send_json(404, {"message": "Unknown Webhook"})
+                    return
+
+                server.count("discord")
+                with server.lock:
+                    now = time.monotonic()
+                    if now >= server.reset_at:
+                        server.remaining = server.bucket_size
+                        server.reset_at = now + server.bucket_reset
+
+                    limited = server.remaining == 0
+                    if not limited:
+                        server.remaining -= 1
+                        server.messages.append(body["content"])
+                    remaining = server.remaining
+                    reset_after = server.reset_at - now
+
+                headers = {}
+                if server.rate_limit_headers:
+                    headers["X-RateLimit-Remaining"] = str(remaining)
+                    headers["X-RateLimit-Reset-After"] = f"{reset_after:.3f}"
+
+                if limited:
+                    server.count("discord 429")
+                    self.send_json(429, {"message": "You are being rate limited.", "retry_after": reset_after,
+                                         "global": False}, headers)
+                else:
+                    self.send_body(204, b"", None, headers)
+
+            def send_runs_page(self, path: str, page: int):
+                # Newest first: the current run, then the earlier successful ones.
+                run_ids = list(range(CURRENT_RUN_ID, CURRENT_RUN_ID - server.runs, -1))
+                start = (page - 1) * server.page_size
+                runs = [server.run_json(run_id) for run_id in run_ids[start:start + server.page_size]]
+
+                headers = {}
+                if start + server.page_size < len(run_ids):
+                    headers["Link"] = f'<{server.url}{path}?page={page + 1}>; rel="next"'
+                self.send_json(200, {"total_count": len(run_ids), "workflow_runs": runs}, headers)
+
+            def send_json(self, status: int, data, headers=None):
+                self.send_body(status, json.dumps(data).encode("utf-8"), "application/json", headers)
+
+            def send_body(self, status: int, body: bytes, content_type, headers=None):
+                self.send_response(status)
+                if content_type:
+                    self.send_header("Content-Type", content_type)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def run_json(self, run_id: int):
+        return {
+            "id": run_id,
+            "created_at": f"2026-01-01T00:{CURRENT_RUN_ID - run_id:02d}:00Z",
+            "workflow_url": f"{self.url}/repos/{REPOSITORY}/actions/workflows/{WORKFLOW_ID}",
+            "head_commit": {"id": LAST_SHA if run_id != CURRENT_RUN_ID else "f" * 40},
+        }
+
+
+def make_entries(count: int, rng: random.Random) -> list[dict]:
+    entries = []
+    for entry_id in range(1, count + 1):
+        changes = []
+        for _ in range(rng.randint(1, 4)):
+            message = " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 60))).capitalize() + "."
+            changes.append({"message": message, "type": rng.choice(list(publisher.TYPES_TO_EMOJI))})
+
+        entries.append({
+            "author": rng.choice(AUTHORS),
+            "changes": changes,
+            "id": entry_id,
+            "labels": [publisher.EXPERIMENTAL_LABEL] if rng.random() < 0.1 else [],
+            "time": "2026-01-01T00:00:00.0000000+00:00",
+            "url": f"https://github.com/{REPOSITORY}/pull/{40000 + entry_id}",
+        })
+    return entries
+
+
+def replay(old_entries: list[dict], new_entries: list[dict], with_state: bool, args) -> dict:
+    old_text = yaml.safe_dump({"Entries": old_entries})
+    cur_text = yaml.safe_dump({"Entries": old_entries + new_entries})
+    expected = "".join(publisher.changelog_entries_to_message_lines(new_entries))
+
+    with tempfile.TemporaryDirectory() as work_dir, \
+            FakeServer(old_text, args.runs, args.page_size, args.bucket_size, args.bucket_reset,
+                       not args.no_rate_limit_headers) as server:
+        changelog_path = Path(work_dir, publisher.CHANGELOG_FILE)
+        changelog_path.parent.mkdir(parents=True)
+        changelog_path.write_text(cur_text, encoding="utf-8-sig")
+
+        state_path = Path(work_dir, "state.json")
+        if with_state:
+            state_path.write_text(json.dumps({"last_id": old_entries[-1]["id"] if old_entries else 0}))
+
+        env = dict(os.environ,
+                   DISCORD_WEBHOOK_URL=f"{server.url}/webhook",
+                   GITHUB_API_URL=server.url,
+                   GITHUB_REPOSITORY=REPOSITORY,
+                   GITHUB_RUN_ID=str(CURRENT_RUN_ID),
+                   GITHUB_TOKEN="fake",
+                   SS14_CHANGELOG_STATE_FILE=str(state_path),
+                   SS14_CHANGELOG_INDEX_DIR=str(Path(work_dir, ".changelog_index")),
+                   SS14_CHANGELOG_DEBUG="")
+
+        start = time.perf_counter()
+        process = subprocess.run([sys.executable, os.path.abspath(publisher.__file__)], cwd=work_dir, env=env,
+                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT, encoding="utf-8")
+        elapsed = time.perf_counter() - start
+
+        if args.verbose:
+            print(process.stdout)
+
+        return {
+            "elapsed": elapsed,
+            "requests": dict(server.requests),
+            "messages": len(server.messages),
+            "ok": process.returncode == 0 and "".join(server.messages) == expected,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the Discord changelog publisher against local fake GitHub and Discord servers.")
+    parser.add_argument("--sizes", default="5,25,100",
+                        help="comma separated numbers of new changelog entries to publish")
+    parser.add_argument("--old-entries", type=int, default=200,
+                        help="entries already published before the run")
+    parser.add_argument("--runs", type=int, default=3,
+                        help="successful workflow runs the fake GitHub lists, including the current one")
+    parser.add_argument("--page-size", type=int, default=1,
+                        help="workflow runs per page, small to exercise pagination")
+    parser.add_argument("--bucket-size", type=int, default=5,
+                        help="webhook requests allowed per rate limit bucket")
+    parser.add_argument("--bucket-reset", type=float, default=2.0,
+                        help="seconds until the webhook's rate limit bucket refills")
+    parser.add_argument("--no-rate-limit-headers", action="store_true",
+                        help="don't send X-RateLimit headers, so the publisher only sees 429s")
+    parser.add_argument("--seed", type=int, default=14)
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="print the publisher's output")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    print(f"{'new':>5} {'mode':>5} {'time':>9} {'messages':>8} {'github':>6} {'discord':>7} {'429s':>4}  result")
+    failed = False
+    for size in sizes:
+        entries = make_entries(args.old_entries + size, rng)
+        old_entries, new_entries = entries[:args.old_entries], entries[args.old_entries:]
+
+        for with_state in (False, True):
+            result = replay(old_entries, new_entries, with_state, args)
+            requests = result["requests"]
+            github = sum(count for name, count in requests.items() if name.startswith("github"))
+            print(f"{size:>5} {'state' if with_state else 'api':>5} {result['elapsed'] * 1000:>7.0f} ms "
+                  f"{result['messages']:>8} {github:>6} {requests.get('discord', 0):>7} "
+                  f"{requests.get('discord 429', 0):>4}  {'ok' if result['ok'] else 'FAILED'}")
+            failed |= not result["ok"]
+
+    if failed:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -14,13 +14,13 @@ import paramiko
 import pathlib
 import io
 import base64
-import yaml
 import itertools
 import html
 import email.utils
 from typing import  List, Any, Tuple
 from lxml import etree as ET
 from datetime import datetime, timedelta, timezone
+from changelog_lib import Changelog
 
 MAX_ITEM_AGE = timedelta(days=30)
 
@@ -67,29 +67,12 @@ XML_NS_ATOM_B = f"{{{XML_NS_ATOM}}}"
 ET.register_namespace("ss14", XML_NS)
 ET.register_namespace("atom", XML_NS_ATOM)
 
-# From https://stackoverflow.com/a/37958106/4678631
-class NoDatesSafeLoader(yaml.SafeLoader):
-    @classmethod
-    def remove_implicit_resolver(cls, tag_to_remove):
-        if not 'yaml_implicit_resolvers' in cls.__dict__:
-            cls.yaml_implicit_resolvers = cls.yaml_implicit_resolvers.copy()
-
-        for first_letter, mappings in cls.yaml_implicit_resolvers.items():
-            cls.yaml_implicit_resolvers[first_letter] = [(tag, regexp)
-                                                         for tag, regexp in mappings
-                                                         if tag != tag_to_remove]
-
-# Hrm yes let's make the fucking default of our serialization library to PARSE ISO-8601
-# but then output garbage when re-serializing.
-NoDatesSafeLoader.remove_implicit_resolver('tag:yaml.org,2002:timestamp')
-
 def main():
     if not CHANGELOG_RSS_KEY:
         print("::notice ::CHANGELOG_RSS_KEY not set, skipping RSS changelogs")
         return
 
-    with open(CHANGELOG_FILE, "r") as f:
-        changelog = yaml.load(f, Loader=NoDatesSafeLoader)
+    changelog = Changelog.load(CHANGELOG_FILE)
 
     with paramiko.SSHClient() as client:
         load_host_keys(client.get_host_keys())
@@ -122,7 +105,7 @@ def main():
             f.write(fh.read())
 
 
-def create_feed(changelog: Any, previous_items: List[Any]) -> Tuple[Any, bool]:
+def create_feed(changelog: Changelog, previous_items: List[Any]) -> Tuple[Any, bool]:
     rss = ET.Element("rss", attrib={"version": "2.0"})
     channel = ET.SubElement(rss, "channel")
 
@@ -145,13 +128,14 @@ def create_feed(changelog: Any, previous_items: List[Any]) -> Tuple[Any, bool]:
 
     return rss, any
 
-def create_new_item_since(changelog: Any, channel: Any, since: int, now: datetime) -> bool:
-    entries_for_item = [entry for entry in changelog["Entries"] if entry["id"] > since]
-    top_entry_id = max(map(lambda e: e["id"], entries_for_item), default=0)
+def create_new_item_since(changelog: Changelog, channel: Any, since: int, now: datetime) -> bool:
+    entries_for_item = changelog.since(since)
 
     if not entries_for_item:
         return False
 
+    top_entry_id = entries_for_item[-1]["id"]
+
     attrs = {XML_NS_B + "from-id": str(since), XML_NS_B + "to-id": str(top_entry_id)}
     new_item = ET.SubElement(channel, "item", attrs)
     ET.SubElement(new_item, "pubDate").text = email.utils.format_datetime(now)
@@ -3,10 +3,12 @@
 """
 Sends updates to a Discord webhook for new changelog entries since the last GitHub Actions publish run.
 
-Automatically figures out the last run and changelog contents with the GitHub API.
+Remembers the id of the last entry it published in a small state file, which the publish workflow keeps between runs.
+Without that file, it figures out the last run and changelog contents with the GitHub API instead.
 """
 
 import itertools
+import json
 import os
 import sys
 import urllib.parse
@@ -14,13 +16,15 @@ from pathlib import Path
 from typing import Any, Iterable
 
 import requests
-import yaml
 import time
 
+from changelog_lib import Changelog, ChangelogEntry
+
 DEBUG = os.environ.get("SS14_CHANGELOG_DEBUG", "").lower() in {"1", "true", "yes"}
 DEBUG_CHANGELOG_FILE_OLD = Path("Resources/Changelog/Old.yml")
 DEBUG_DISCORD_DUMP_FILE = Path("Resources/Changelog/DiscordDebug.md")
 GITHUB_API_URL = os.environ.get("GITHUB_API_URL", "https://api.github.com")
+STATE_FILE = Path(os.environ.get("SS14_CHANGELOG_STATE_FILE", ".changelog_discord_state.json"))
 
 # https://discord.com/developers/docs/resources/webhook
 DISCORD_SPLIT_LIMIT = 2000
@@ -34,28 +38,22 @@ TYPES_TO_EMOJI = {"Fix": "🐛", "Add": "🆕", "Remove": "❌", "Tweak": "⚒
 EXPERIMENTAL_LABEL = "Intent: Experimental"
 EXPERIMENTAL_EMOJI = "🧪"
 
-ChangelogEntry = dict[str, Any]
-
 
 def main():
     if not DEBUG and not DISCORD_WEBHOOK_URL:
         print("No discord webhook URL found, skipping discord send")
         return
 
+    cur_changelog = Changelog.load(CHANGELOG_FILE)
+
     if DEBUG:
         # to debug this script locally, you can use
         # a separate local file as the old changelog
-        last_changelog_stream = DEBUG_CHANGELOG_FILE_OLD.read_text(encoding="utf-8-sig")
+        last_changelog = Changelog.parse(DEBUG_CHANGELOG_FILE_OLD.read_text(encoding="utf-8-sig"))
+        diff = diff_changelog(last_changelog, cur_changelog)
     else:
-        # when running this normally in a GitHub actions workflow,
-        # it will get the old changelog from the GitHub API
-        last_changelog_stream = get_last_changelog()
-
-    last_changelog = yaml.safe_load(last_changelog_stream)
-    with open(CHANGELOG_FILE, "r", encoding="utf-8-sig") as f:
-        cur_changelog = yaml.safe_load(f)
+        diff = get_new_entries(cur_changelog)
 
-    diff = diff_changelog(last_changelog, cur_changelog)
     message_lines = changelog_entries_to_message_lines(diff)
 
     if DEBUG:
@@ -63,6 +61,47 @@ def main():
         return
 
     send_message_lines(message_lines)
+    save_last_published_id(cur_changelog.max_id)
+
+
+def get_new_entries(cur_changelog: Changelog) -> Iterable[ChangelogEntry]:
+    """
+    Entries are numbered in order, so everything after the last published id is new. Only when that id isn't known,
+    the previous changelog is fetched with the GitHub API and compared with the current one.
+    """
+    last_id = load_last_published_id()
+    if last_id is not None and last_id <= cur_changelog.max_id:
+        print(f"Last published changelog entry was {last_id}")
+        return cur_changelog.since(last_id)
+
+    if last_id is not None:
+        print(f"Last published changelog entry {last_id} is past the end of the changelog, comparing with the last run instead")
+
+    # when running this normally in a GitHub actions workflow,
+    # it will get the old changelog from the GitHub API
+    last_changelog = Changelog.parse(get_last_changelog())
+    return diff_changelog(last_changelog, cur_changelog)
+
+
+def load_last_published_id() -> int | None:
+    try:
+        state = json.loads(STATE_FILE.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        print(f"No publish state in {STATE_FILE}")
+        return None
+    except ValueError as e:
+        print(f"Ignoring unreadable publish state in {STATE_FILE}: {e}")
+        return None
+
+    last_id = state.get("last_id")
+    return last_id if isinstance(last_id, int) else None
+
+
+def save_last_published_id(last_id: int):
+    # Only written once everything was sent, a failed run leaves the previous state so it is all sent again.
+    tmp_path = STATE_FILE.with_name(STATE_FILE.name + ".tmp")
+    tmp_path.write_text(json.dumps({"last_id": last_id}), encoding="utf-8")
+    tmp_path.replace(STATE_FILE)
 
 
 def get_most_recent_workflow(
@@ -156,14 +195,11 @@ def get_last_changelog_by_sha(
     return resp.text
 
 
-def diff_changelog(
-    old: dict[str, Any], cur: dict[str, Any]
-) -> Iterable[ChangelogEntry]:
+def diff_changelog(old: Changelog, cur: Changelog) -> Iterable[ChangelogEntry]:
     """
     Find all new entries not present in the previous publish.
     """
-    old_entry_ids = {e["id"] for e in old["Entries"]}
-    return (e for e in cur["Entries"] if e["id"] not in old_entry_ids)
+    return cur.not_in(old)
 
 
 def get_discord_body(content: str):
@@ -176,26 +212,63 @@ def get_discord_body(content: str):
     }
 
 
-def send_discord_webhook(lines: list[str]):
-    content = "".join(lines)
-    body = get_discord_body(content)
-    retry_attempt = 0
+class DiscordWebhookSender:
+    """
+    Posts messages to a Discord webhook one after another, so they show up in order, over a single pooled session.
+    Follows the webhook's rate limit bucket headers to wait before a request would be limited, instead of only
+    backing off after a 429.
+    """
 
-    try:
-        response = requests.post(DISCORD_WEBHOOK_URL, json=body, timeout=10)
-        while response.status_code == 429:
-            retry_attempt += 1
-            if retry_attempt > 20:
-                print("Too many retries on a single request despite following retry_after header... giving up")
-                exit(1)
-            retry_after = response.json().get("retry_after", 5)
+    MAX_RETRIES = 20
+
+    def __init__(self, url: str, session: requests.Session | None = None):
+        self.url = url
+        self.session = session or requests.Session()
+        self.requests_sent = 0
+        # Requests left in the current bucket, unknown until the first response.
+        self.remaining: int | None = None
+        # time.monotonic() at which the bucket refills.
+        self.reset_at = 0.0
+
+    def send(self, content: str):
+        body = get_discord_body(content)
+
+        for _ in range(self.MAX_RETRIES + 1):
+            self.wait_for_bucket()
+            response = self.session.post(self.url, json=body, timeout=10)
+            self.requests_sent += 1
+            self.update_bucket(response)
+
+            if response.status_code != 429:
+                response.raise_for_status()
+                return
+
+            retry_after = float(response.json().get("retry_after", response.headers.get("Retry-After", 5)))
             print(f"Rate limited, retrying after {retry_after} seconds")
-            time.sleep(retry_after)
-            response = requests.post(DISCORD_WEBHOOK_URL, json=body, timeout=10)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        print(f"Failed to send message: {e}")
-        exit(1)
+            self.remaining = 0
+            self.reset_at = max(self.reset_at, time.monotonic() + retry_after)
+
+        raise requests.exceptions.RetryError("Too many retries on a single request despite following retry_after header... giving up")
+
+    def wait_for_bucket(self):
+        if self.remaining != 0:
+            return
+
+        delay = self.reset_at - time.monotonic()
+        if delay > 0:
+            print(f"Rate limit bucket empty, waiting {delay:.2f} seconds")
+            time.sleep(delay)
+        self.remaining = None
+
+    def update_bucket(self, response: requests.Response):
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        reset_after = response.headers.get("X-RateLimit-Reset-After")
+        if remaining is None or reset_after is None:
+            return
+
+        # Reset-After is relative, so it doesn't depend on our clock agreeing with Discord's.
+        self.remaining = int(remaining)
+        self.reset_at = time.monotonic() + float(reset_after)
 
 
 def truncate_to_limit(text: str, limit: int) -> str:
@@ -250,37 +323,83 @@ def changelog_entries_to_message_lines(entries: Iterable[ChangelogEntry]) -> lis
     return message_lines
 
 
-def split_message_lines(message_lines: list[str]) -> list[list[str]]:
-    """Join message lines into chunks that are each below Discord's message length limit."""
-    chunks = []
-    chunk_lines = []
-    chunk_length = 0
+def group_message_lines(message_lines: list[str]) -> list[list[str]]:
+    """
+    Group message lines into units that must not be split over two messages: the blank line and header starting an
+    author's changes stay together with their first change, every other change is a unit of its own.
+    """
+    units = []
+    glued = 0
 
     for line in message_lines:
-        line_length = len(line)
-        if line_length > DISCORD_SPLIT_LIMIT:
+        if len(line) > DISCORD_SPLIT_LIMIT:
             raise ValueError(
-                f"Changelog line is too long for Discord after truncation: {line_length}"
+                f"Changelog line is too long for Discord after truncation: {len(line)}"
             )
 
-        new_chunk_length = chunk_length + line_length
+        if line == "\n":
+            # Blank line before an author header, glue the header and first change to it.
+            units.append([line])
+            glued = 2
+        elif glued and units:
+            units[-1].append(line)
+            glued -= 1
+        else:
+            units.append([line])
+
+    # A header with a change so long that they don't fit in one message together has to be split after all.
+    result = []
+    for unit in units:
+        if sum(map(len, unit)) > DISCORD_SPLIT_LIMIT:
+            result.append(unit[:-1])
+            result.append(unit[-1:])
+        else:
+            result.append(unit)
+    return result
 
-        if new_chunk_length > DISCORD_SPLIT_LIMIT:
-            if chunk_lines:
-                chunks.append(chunk_lines)
 
-            new_chunk_length = line_length
-            chunk_lines = []
-
-        chunk_lines.append(line)
-        chunk_length = new_chunk_length
+def split_message_lines(message_lines: list[str]) -> list[list[str]]:
+    """
+    Join message lines into as few chunks below Discord's message length limit as possible, keeping them in order.
+    An author's header always stays with their first change, and out of the packings with the fewest chunks,
+    the one splitting the fewest authors' changes over two messages is used.
+    """
+    units = group_message_lines(message_lines)
+    lengths = [sum(map(len, unit)) for unit in units]
+    starts_author = [unit[0] == "\n" for unit in units]
+
+    # best[i] is the (chunks, authors split) cost of packing the first i units, with the last chunk starting at
+    # unit chunk_start[i]. A chunk never holds more than the limit, so only a short window before i is looked at.
+    best = [(0, 0)] + [None] * len(units)
+    chunk_start = [0] * (len(units) + 1)
+    for i in range(1, len(units) + 1):
+        chunk_length = 0
+        for j in range(i - 1, -1, -1):
+            chunk_length += lengths[j]
+            if chunk_length > DISCORD_SPLIT_LIMIT:
+                break
+
+            splits_author = j > 0 and not starts_author[j]
+            cost = (best[j][0] + 1, best[j][1] + splits_author)
+            if best[i] is None or cost < best[i]:
+                best[i] = cost
+                chunk_start[i] = j
 
-    if chunk_lines:
-        chunks.append(chunk_lines)
+    chunks = []
+    i = len(units)
+    while i > 0:
+        j = chunk_start[i]
+        chunks.append([line for unit in units[j:i] for line in unit])
+        i = j
+    chunks.reverse()
 
     return chunks
 
 
+def chunk_fill_ratios(chunks: list[list[str]]) -> list[float]:
+    return [sum(map(len, chunk_lines)) / DISCORD_SPLIT_LIMIT for chunk_lines in chunks]
+
+
 def dump_debug_markdown(message_lines: list[str]):
     chunks = split_message_lines(message_lines)
 
@@ -294,10 +413,16 @@ def dump_debug_markdown(message_lines: list[str]):
             f.write("_No changelog entries to send._\n")
             return
 
-        for i, chunk_lines in enumerate(chunks, start=1):
+        fills = chunk_fill_ratios(chunks)
+        f.write(
+            f"{len(message_lines)} lines packed into {len(chunks)} messages, "
+            f"{sum(fills) / len(fills):.0%} full on average, emptiest {min(fills):.0%}.\n\n"
+        )
+
+        for i, (chunk_lines, fill) in enumerate(zip(chunks, fills), start=1):
             content = "".join(chunk_lines)
             f.write(
-                f"<!-- Discord message break: chunk {i}/{len(chunks)}, {len(content)}/{DISCORD_SPLIT_LIMIT} characters -->\n\n"
+                f"<!-- Discord message break: chunk {i}/{len(chunks)}, {len(content)}/{DISCORD_SPLIT_LIMIT} characters, {fill:.0%} full -->\n\n"
             )
             f.write(f"## Discord Message {i}\n\n")
             f.write(content.lstrip("\n"))
@@ -309,14 +434,22 @@ def dump_debug_markdown(message_lines: list[str]):
 def send_message_lines(message_lines: list[str]):
     """Join a list of message lines into chunks that are each below Discord's message length limit, and send them."""
     chunks = split_message_lines(message_lines)
+    sender = DiscordWebhookSender(DISCORD_WEBHOOK_URL)
+    start = time.perf_counter()
 
-    for chunk_lines in chunks[:-1]:
-        print("Split changelog and sending to discord")
-        send_discord_webhook(chunk_lines)
+    try:
+        for i, chunk_lines in enumerate(chunks, start=1):
+            if i < len(chunks):
+                print("Split changelog and sending to discord")
+            else:
+                print("Sending final changelog to discord")
+            sender.send("".join(chunk_lines))
+    except requests.exceptions.RequestException as e:
+        print(f"Failed to send message: {e}")
+        exit(1)
 
     if chunks:
-        print("Sending final changelog to discord")
-        send_discord_webhook(chunks[-1])
+        print(f"Sent {len(chunks)} messages with {sender.requests_sent} requests in {time.perf_counter() - start:.2f} s")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+# Shared changelog loading for update_changelog.py, actions_changelogs_since_last_run.py and actions_changelog_rss.py.
+#
+# A changelog is parsed once with libyaml (when PyYAML has it) into entries sorted by id, which can then be queried
+# by id range with bisect. Parsed changelogs are also kept in a small JSON index, one file per changelog text named
+# after its hash, so running the tools again on the same changelog on the same machine doesn't parse any YAML at all.
+# The index is only a cache: if it can't be read or written, the YAML is simply parsed.
+
+import bisect
+import hashlib
+import json
+import os
+from typing import Any, List, Optional
+import yaml
+
+# libyaml's C loader and dumper are many times faster than the pure Python ones, use them when PyYAML has them.
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+SafeDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+# Where parsed changelogs are indexed, in the repository root whatever directory the tools are run from.
+# SS14_CHANGELOG_INDEX_DIR overrides it, and setting it empty turns the index off.
+INDEX_DIR = os.environ.get("SS14_CHANGELOG_INDEX_DIR",
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".changelog_index")) or None
+# Bump when the index layout changes, so old index files are ignored.
+INDEX_VERSION = 1
+# How many index files to keep, the current changelog and a few older versions of it.
+INDEX_KEEP = 8
+
+ChangelogEntry = dict[str, Any]
+
+# From https://stackoverflow.com/a/37958106/4678631
+class NoDatesSafeLoader(SafeLoader):
+    @classmethod
+    def remove_implicit_resolver(cls, tag_to_remove):
+        if not 'yaml_implicit_resolvers' in cls.__dict__:
+            cls.yaml_implicit_resolvers = cls.yaml_implicit_resolvers.copy()
+
+        for first_letter, mappings in cls.yaml_implicit_resolvers.items():
+            cls.yaml_implicit_resolvers[first_letter] = [(tag, regexp)
+                                                         for tag, regexp in mappings
+                                                         if tag != tag_to_remove]
+
+# Hrm yes let's make the fucking default of our serialization library to PARSE ISO-8601
+# but then output garbage when re-serializing.
+NoDatesSafeLoader.remove_implicit_resolver('tag:yaml.org,2002:timestamp')
+
+# New entries are dumped apart from the rest of the file, where anchors could clash with ones already there.
+class NoAliasesSafeDumper(SafeDumper):
+    def ignore_aliases(self, data):
+        return True
+
+class Changelog:
+    """
+    A changelog with its entries sorted by id. Keeps the original text of every entry, so only new entries are
+    serialized when it is written back and the rest of the file stays exactly as it was.
+    """
+
+    def __init__(self, data: dict[str, Any], entries: List[ChangelogEntry], chunks: List[Optional[str]]):
+        self.data = data
+        self.entries = entries
+        # Original text of each entry, or None for entries that need to be serialized.
+        self.chunks = chunks
+
+        # Entries are written in id order, so normally there is nothing to sort and the last id is the highest.
+        ids = [e["id"] for e in self.entries]
+        if any(a > b for a, b in zip(ids, ids[1:])):
+            order = sorted(range(len(ids)), key=ids.__getitem__)
+            self.entries = [self.entries[i] for i in order]
+            self.chunks = [self.chunks[i] for i in order]
+            ids = [ids[i] for i in order]
+        self.ids = ids
+
+    @classmethod
+    def parse(cls, text: str, index_dir: Optional[str] = INDEX_DIR) -> "Changelog":
+        """
+        Parses the text of a changelog, or loads it from the index if this exact text was parsed before.
+        """
+        # Text from the GitHub API still has the BOM, which libyaml leaves out of its marks.
+        text = text.removeprefix("\ufeff")
+
+        index_path = None
+        if index_dir is not None:
+            digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+            index_path = os.path.join(index_dir, f"{digest}.json")
+            changelog = cls.load_index(index_path)
+            if changelog is not None:
+                return changelog
+
+        changelog = cls.parse_yaml(text)
+        if index_path is not None:
+            changelog.save_index(index_path)
+        return changelog
+
+    @classmethod
+    def load(cls, path: str, index_dir: Optional[str] = INDEX_DIR) -> "Changelog":
+        with open(path, "r", encoding="utf-8-sig") as f:
+            return cls.parse(f.read(), index_dir)
+
+    @classmethod
+    def parse_yaml(cls, text: str) -> "Changelog":
+        loader = NoDatesSafeLoader(text)
+        try:
+            node = loader.get_single_node()
+            data = loader.construct_document(node) if node is not None else None
+        finally:
+            loader.dispose()
+
+        data = data or {}
+        entries = data.pop("Entries", None) or []
+        chunks = [None] * len(entries)
+
+        entries_node = None
+        if node is not None:
+            entries_node = next((v for k, v in node.value if k.value == "Entries"), None)
+        if isinstance(entries_node, yaml.SequenceNode) and entries_node.value:
+            # Only reuse the text of block sequences with each item at the start of a line, like yaml.dump writes.
+            starts = [text.rfind("\n", 0, item.start_mark.index) + 1 for item in entries_node.value]
+            end = entries_node.end_mark.index
+            if all(text.startswith("- ", start) for start in starts) and text[end - 1] == "\n":
+                chunks = [text[a:b] for a, b in zip(starts, starts[1:] + [end])]
+
+        return cls(data, entries, chunks)
+
+    @classmethod
+    def load_index(cls, path: str) -> Optional["Changelog"]:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if index.get("version") != INDEX_VERSION:
+            return None
+
+        # Touch it, so pruning keeps the index files that are actually used.
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return cls(index["data"], index["entries"], index["chunks"])
+
+    def save_index(self, path: str):
+        index = {"version": INDEX_VERSION, "data": self.data, "entries": self.entries, "chunks": self.chunks}
+        try:
+            text = json.dumps(index, ensure_ascii=False, separators=(",", ":"))
+        except (TypeError, ValueError):
+            # Something in the changelog JSON can't hold, just parse the YAML every time.
+            return
+
+        # The index is only a cache, so failing to write it mustn't fail the tool using it.
+        index_dir = os.path.dirname(path)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(index_dir, exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+
+            old = sorted((entry for entry in os.scandir(index_dir) if entry.name.endswith(".json")),
+                         key=lambda entry: entry.stat().st_mtime, reverse=True)
+            for entry in old[INDEX_KEEP:]:
+                os.remove(entry.path)
+        except OSError as e:
+            print(f"Couldn't write the changelog index {path}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    @property
+    def max_id(self) -> int:
+        return self.ids[-1] if self.ids else 0
+
+    def since(self, since: int) -> List[ChangelogEntry]:
+        """
+        Entries with an id above since, oldest first.
+        """
+        return self.entries[bisect.bisect_right(self.ids, since):]
+
+    def between(self, low: int, high: int) -> List[ChangelogEntry]:
+        """
+        Entries with an id from low to high, both included.
+        """
+        return self.entries[bisect.bisect_left(self.ids, low):bisect.bisect_right(self.ids, high)]
+
+    def has_id(self, entry_id: int) -> bool:
+        i = bisect.bisect_left(self.ids, entry_id)
+        return i < len(self.ids) and self.ids[i] == entry_id
+
+    def not_in(self, other: "Changelog") -> List[ChangelogEntry]:
+        """
+        Entries with ids that aren't in the other changelog, found by walking both sorted id lists once.
+        """
+        result = []
+        j = 0
+        for entry_id, entry in zip(self.ids, self.entries):
+            while j < len(other.ids) and other.ids[j] < entry_id:
+                j += 1
+            if j == len(other.ids) or other.ids[j] != entry_id:
+                result.append(entry)
+        return result
+
+    def add(self, entry: ChangelogEntry) -> int:
+        # New ids are always above the existing ones, so appending keeps the entries sorted.
+        new_id = self.max_id + 1
+        entry["id"] = new_id
+        self.entries.append(entry)
+        self.chunks.append(None)
+        self.ids.append(new_id)
+        return new_id
+
+    def trim(self, max_entries: int) -> int:
+        overflow = len(self.entries) - max_entries
+        if overflow > 0:
+            del self.entries[:overflow]
+            del self.chunks[:overflow]
+            del self.ids[:overflow]
+        return max(overflow, 0)
+
+    def dump(self) -> str:
+        # Dump everything except the entries with a placeholder in their place, so the other keys keep the
+        # order and format yaml.dump gives them, then put the entries' text where the placeholder is.
+        new_data = dict(self.data)
+        new_data["Entries"] = []
+        text = yaml.dump(new_data, Dumper=NoAliasesSafeDumper)
+        if not self.entries:
+            return text
+
+        before, placeholder, after = text.partition("Entries: []\n")
+        assert placeholder, "Entries placeholder missing from the dumped changelog"
+
+        for i, (entry, chunk) in enumerate(zip(self.entries, self.chunks)):
+            if chunk is None:
+                self.chunks[i] = yaml.dump([entry], Dumper=NoAliasesSafeDumper)
+        return before + "Entries:\n" + "".join(self.chunks) + after
+
+    def save(self, path: str, index_dir: Optional[str] = INDEX_DIR):
+        """
+        Writes the changelog, and indexes the new text so the next tool to load it doesn't have to parse it.
+        """
+        text = self.dump()
+        with open(path, "w", encoding="utf-8-sig") as f:
+            f.write(text)
+
+        if index_dir is not None:
+            digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+            self.save_index(os.path.join(index_dir, f"{digest}.json"))
@@ -1,18 +1,121 @@
 #!/usr/bin/env python3
 
+import argparse
+import concurrent.futures
+import itertools
+import json
+import os
+import re
+import shutil
 import subprocess
-from typing import Iterable
+import threading
+import time
+from typing import Iterable, Iterator, Optional, Tuple
+
+# Files are read in chunks this big, so large maps and YAML files never have to fit in memory at once.
+CHUNK_SIZE = 1 << 20
+# Like git, a blob with a NUL byte this close to the start is treated as binary and not checked.
+BINARY_CHECK_SIZE = 8000
+# Mode of submodule entries in the index, which have no blob to read.
+GITLINK_MODE = "160000"
+# Bump when the verdicts change meaning, so old caches are thrown away.
+CACHE_VERSION = 1
+CRLF_RE = re.compile(rb"\r+\n")
 
 def main() -> int:
+    parser = argparse.ArgumentParser(description="Check that no text file in the git index has CRLF line endings.")
+    parser.add_argument("--since", metavar="REF",
+                        help="only check files changed between REF and the index, read from git's object store")
+    parser.add_argument("--cache", metavar="FILE",
+                        help="file remembering the verdict for each blob SHA, so unchanged blobs are never read again")
+    parser.add_argument("--fix", action="store_true",
+                        help="rewrite files with CRLF line endings in the working tree to use LF instead")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    verdicts = load_cache(args.cache) if args.cache else {}
+    cached = len(verdicts)
+    blobs = {}
+    if args.since or args.cache:
+        blobs = get_index_blobs()
+        file_names = get_changed_files(args.since) if args.since else list(blobs)
+        listed = time.perf_counter()
+        results = check_blobs(file_names, blobs, verdicts)
+    else:
+        file_names = list(get_text_files())
+        listed = time.perf_counter()
+        results = check_files(file_names)
+
     any_failed = False
-    for file_name in get_text_files():
-        if is_file_crlf(file_name):
+    checked = 0
+    to_fix = []
+    for file_name, crlf in results:
+        if crlf is None:
+            continue
+        checked += 1
+        if crlf and args.fix:
+            to_fix.append(file_name)
+        elif crlf:
             print(f"::error file={file_name},title=File contains CRLF line endings::The file '{file_name}' was committed with CRLF new lines. Please make sure your git client is configured correctly and you are not uploading files directly to GitHub via the web interface.")
             any_failed = True
 
+    end = time.perf_counter()
+    print(f"Checked {checked} text files in {end - start:.2f} s ({listed - start:.2f} s listing, {end - listed:.2f} s scanning)")
+
+    if args.cache:
+        # Only blobs still in the index are kept, so the cache doesn't grow forever.
+        save_cache(args.cache, {sha: verdicts[sha] for sha in blobs.values() if sha in verdicts})
+        print(f"Cache: {len(verdicts) - cached} blobs read, {cached} known before")
+
+    if to_fix:
+        any_failed = not fix_files(to_fix)
     return 1 if any_failed else 0
 
 
+def fix_files(file_names: list[str]) -> bool:
+    start = time.perf_counter()
+    fixed = 0
+    all_fixed = True
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        for file_name, future in zip(file_names, [executor.submit(fix_file, x) for x in file_names]):
+            try:
+                count = future.result()
+            except OSError as e:
+                print(f"Failed to fix {file_name}: {e}")
+                all_fixed = False
+                continue
+
+            if count:
+                fixed += 1
+                print(f"Fixed {file_name}: {count} CRLF line endings")
+            else:
+                print(f"Skipped {file_name}: already uses LF in the working tree")
+
+    print(f"Fixed {fixed} files in {time.perf_counter() - start:.2f} s, remember to stage them")
+    return all_fixed
+
+
+def load_cache(path: str) -> dict[str, Optional[bool]]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        print(f"Ignoring unreadable cache {path}")
+        return {}
+
+    if data.get("version") != CACHE_VERSION:
+        return {}
+    return data["blobs"]
+
+def save_cache(path: str, verdicts: dict[str, Optional[bool]]):
+    # Written next to the old file and swapped in, so an interrupted run never leaves a broken cache.
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": CACHE_VERSION, "blobs": verdicts}, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
 def get_text_files() -> Iterable[str]:
     # https://stackoverflow.com/a/24350112/4678631
     process = subprocess.run(
@@ -24,12 +127,142 @@ def get_text_files() -> Iterable[str]:
     for x in process.stdout.splitlines():
         yield x.strip()
 
+def get_changed_files(since: str) -> list[str]:
+    # Files deleted since the ref are left out, there is nothing left to check.
+    process = subprocess.run(
+        ["git", "diff", "--cached", "--name-only", "--diff-filter=d", "-z", since, "--"],
+        check=True,
+        encoding="utf-8",
+        stdout=subprocess.PIPE)
+
+    return [x for x in process.stdout.split("\0") if x]
+
+def get_index_blobs() -> dict[str, str]:
+    # Maps each path in the index to the SHA of its blob.
+    process = subprocess.run(
+        ["git", "ls-files", "--stage", "-z"],
+        check=True,
+        encoding="utf-8",
+        stdout=subprocess.PIPE)
+
+    blobs = {}
+    for entry in process.stdout.split("\0"):
+        if not entry:
+            continue
+        info, path = entry.split("\t", 1)
+        mode, sha, _stage = info.split()
+        if mode != GITLINK_MODE:
+            blobs[path] = sha
+    return blobs
+
+def check_files(file_names: list[str]) -> Iterator[Tuple[str, Optional[bool]]]:
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        # map() keeps the output in the same order as git lists the files.
+        yield from zip(file_names, executor.map(is_file_crlf, file_names))
+
+def check_blobs(file_names: list[str], blobs: dict[str, str], verdicts: dict[str, Optional[bool]]) -> Iterator[Tuple[str, Optional[bool]]]:
+    # Reads the blobs straight from the object store through one git cat-file process, so the working tree
+    # doesn't matter. Verdicts are looked up and stored by blob SHA, so each blob is read at most once.
+    # Yields None instead of a verdict for binary blobs.
+    file_names = [x for x in file_names if x in blobs]
+    pending = list(dict.fromkeys(blobs[x] for x in file_names if blobs[x] not in verdicts))
+
+    # Blobs git doesn't have, which get no verdict (None means binary) but mustn't be read from the pipe twice.
+    missing = set()
+
+    with subprocess.Popen(["git", "cat-file", "--batch"], stdin=subprocess.PIPE, stdout=subprocess.PIPE) as process:
+        # Requests are written from another thread so neither pipe can fill up while the other side waits.
+        writer = threading.Thread(target=write_requests, args=(process.stdin, pending))
+        writer.start()
+
+        for file_name in file_names:
+            sha = blobs[file_name]
+            if sha in verdicts:
+                yield file_name, verdicts[sha]
+                continue
+            if sha in missing:
+                continue
+
+            # Unknown blobs come back in the order they were first seen, which is the order of this loop.
+            header = process.stdout.readline().split()
+            if not header:
+                raise RuntimeError(f"git cat-file stopped before {sha} ({file_name})")
+            if header[-1] == b"missing":
+                missing.add(sha)
+                continue
+            verdicts[sha] = is_blob_crlf(process.stdout, int(header[2]))
+            # Each object's content is followed by a newline.
+            process.stdout.read(1)
+            yield file_name, verdicts[sha]
+
+        writer.join()
+
+def write_requests(stdin, shas: list[str]):
+    for sha in shas:
+        stdin.write(sha.encode("ascii") + b"\n")
+    stdin.close()
+
 def is_file_crlf(path: str) -> bool:
-    # https://stackoverflow.com/a/29697732/4678631
     with open(path, "rb") as f:
-        for line in f:
-            if line.endswith(b"\r\n"):
-                return True
+        return has_crlf(read_chunks(f))
+
+def is_blob_crlf(f, size: int) -> Optional[bool]:
+    chunks = read_chunks(f, size)
+    first = next(chunks, b"")
+    if first.find(b"\0", 0, BINARY_CHECK_SIZE) != -1:
+        crlf = None
+    else:
+        crlf = has_crlf(itertools.chain([first], chunks))
+
+    # Skip whatever is left after the first hit, so the next object can be read.
+    for _ in chunks:
+        pass
+    return crlf
+
+def fix_file(path: str) -> int:
+    # Streams the file through a temporary copy one chunk at a time, so even huge maps aren't loaded whole,
+    # then swaps it in. Returns how many line endings were replaced, leaving the file alone if none were.
+    tmp_path = path + ".crlf.tmp"
+    count = 0
+    with open(path, "rb") as src, open(tmp_path, "wb") as dst:
+        carry = b""
+        for chunk in read_chunks(src):
+            chunk = carry + chunk
+            # Trailing \r's might belong to a line ending split over two chunks.
+            stripped = chunk.rstrip(b"\r")
+            carry = chunk[len(stripped):]
+            # Every \r before a \n goes, so a \r\r\n doesn't just turn into another \r\n.
+            stripped, replaced = CRLF_RE.subn(b"\n", stripped)
+            count += replaced
+            dst.write(stripped)
+        dst.write(carry)
+
+    if not count:
+        os.remove(tmp_path)
+        return 0
+
+    shutil.copymode(path, tmp_path)
+    os.replace(tmp_path, path)
+    return count
+
+def read_chunks(f, size: int = -1) -> Iterator[bytes]:
+    # Reads the whole stream, or exactly size bytes of it.
+    while size != 0:
+        chunk = f.read(CHUNK_SIZE if size < 0 else min(size, CHUNK_SIZE))
+        if not chunk:
+            break
+        if size > 0:
+            size -= len(chunk)
+        yield chunk
+
+def has_crlf(chunks: Iterable[bytes]) -> bool:
+    # Searches each chunk with bytes.find, which is much faster than splitting it into lines in Python.
+    # The last byte of the previous chunk is kept so a \r\n split between two chunks is still found.
+    prev = b""
+    for chunk in chunks:
+        if prev + chunk[:1] == b"\r\n" or chunk.find(b"\r\n") != -1:
+            return True
+        prev = chunk[-1:]
 
     return False
 
@@ -1,54 +1,205 @@
 #This is script that was used to generate textures for heatdistortion
 
+# Textures are described by specs, which say how to fill each channel of an image:
+#
+# - output: perlin_noise.png
+#   size: 512            # or [width, height]
+#   channels:            # any of R, G, B, A or combinations like RGB; RGB default to 0 and A to 1
+#     RGB: {noise: Perlin, fractal: FBm, octaves: 4, frequency: 0.01, seed: 1337, seamless: false}
+#     A: {constant: 1.0}
+#
+# Channel sources:
+#   noise: a pyfastnoiselite NoiseType (Perlin, OpenSimplex2, Cellular, ...), mapped from -1..1 to 0..1
+#     with optional fractal (FBm, Ridged, PingPong, ...), octaves, gain, lacunarity, frequency, seed and seamless.
+#   falloff: circle, square or diamond, fading from 1 in the middle to 0 at the edge,
+#     with optional curve (smoothstep or linear).
+#   constant: a fixed value from 0 to 1.
+#
+# Pass --specs with a JSON or YAML list of specs to build a set of textures; without it, the heat distortion
+# textures are built. Textures are rendered in bands of rows spread over a process pool.
+
 from pyfastnoiselite.pyfastnoiselite import FastNoiseLite, NoiseType, FractalType
 from PIL import Image
-import math
-
-def generate_noise_image(output_filename="perlin_noise.png"):
-    width = 512
-    height = 512
-    
-    noise = FastNoiseLite()
-    
-    noise.noise_type = NoiseType.NoiseType_Perlin
-    noise.fractal_type = FractalType.FractalType_FBm
-    noise.fractal_octaves = 4
-    noise.frequency = 0.01
-
-    image = Image.new("RGBA", (width, height))
-    pixels = image.load()
-
-    for x in range(width):
-        for y in range(height):
-            value = (noise.get_noise(x, y) + 1.0) / 2.0
-            color_val = int(value * 255)
-            color_val = max(0, min(255, color_val))
-            
-            pixels[x, y] = (color_val, color_val, color_val, 255)
-    image.save(output_filename)
-    print(f"Success! Image exported to: {output_filename}")
-
-def generate_soft_circle_texture(output_filename="soft_circle.png"):
-    width = 64
-    height = 64
-    
-    image = Image.new("RGBA", (width, height))
-    pixels = image.load()
-    
+import argparse
+import concurrent.futures
+import json
+import numpy as np
+import time
+
+CHANNELS = "RGBA"
+
+def default_specs(size=512, octaves=4, frequency=0.01, seamless=False, circle_size=64):
+    return [
+        {
+            "output": "perlin_noise.png",
+            "size": size,
+            "channels": {
+                "RGB": {"noise": "Perlin", "fractal": "FBm", "octaves": octaves, "frequency": frequency, "seamless": seamless},
+            },
+        },
+        {
+            "output": "soft_circle.png",
+            "size": circle_size,
+            "channels": {
+                "RGB": {"constant": 1.0},
+                "A": {"falloff": "circle"},
+            },
+        },
+    ]
+
+def load_specs(path):
+    with open(path, "r", encoding="utf-8-sig") as f:
+        if path.endswith(".json"):
+            specs = json.load(f)
+        else:
+            import yaml
+            specs = yaml.safe_load(f)
+
+    for spec in specs:
+        validate_spec(spec)
+    return specs
+
+def spec_size(spec):
+    size = spec["size"]
+    if isinstance(size, int):
+        return size, size
+    return size[0], size[1]
+
+def validate_spec(spec):
+    if "output" not in spec or "size" not in spec or "channels" not in spec:
+        raise ValueError(f"Texture spec needs output, size and channels: {spec}")
+
+    width, height = spec_size(spec)
+    if width < 1 or height < 1:
+        raise ValueError(f"{spec['output']}: size must be positive")
+
+    seen = set()
+    for channels, source in spec["channels"].items():
+        for channel in channels:
+            if channel not in CHANNELS or channel in seen:
+                raise ValueError(f"{spec['output']}: bad or repeated channel '{channel}' in '{channels}'")
+            seen.add(channel)
+
+        if "noise" in source:
+            if not hasattr(NoiseType, "NoiseType_" + source["noise"]) or not hasattr(FractalType, "FractalType_" + source.get("fractal", "None")):
+                raise ValueError(f"{spec['output']}: unknown noise or fractal type {source}")
+        elif "falloff" in source:
+            if source["falloff"] not in FALLOFF_DISTANCES or source.get("curve", "smoothstep") not in FALLOFF_CURVES:
+                raise ValueError(f"{spec['output']}: unknown falloff {source}")
+        elif "constant" not in source:
+            raise ValueError(f"{spec['output']}: channel '{channels}' needs one of noise, falloff or constant")
+
+def sample_noise(noise, xs, ys):
+    # Samples the whole grid in one call instead of one get_noise per pixel.
+    coords = np.stack([xs.ravel(), ys.ravel()]).astype(np.float32)
+    return noise.gen_from_coords(coords).astype(np.float64).reshape(xs.shape)
+
+def noise_channel(source, xs, ys, width, height):
+    noise = FastNoiseLite(source.get("seed", 1337))
+
+    noise.noise_type = getattr(NoiseType, "NoiseType_" + source["noise"])
+    noise.fractal_type = getattr(FractalType, "FractalType_" + source.get("fractal", "None"))
+    noise.fractal_octaves = source.get("octaves", 3)
+    noise.fractal_gain = source.get("gain", 0.5)
+    noise.fractal_lacunarity = source.get("lacunarity", 2.0)
+    noise.frequency = source.get("frequency", 0.01)
+
+    if source.get("seamless", False):
+        # Blend the noise with copies of itself shifted by a whole period, weighted by distance to each edge,
+        # so the right/bottom edges continue into the left/top ones.
+        wx = xs / width
+        wy = ys / height
+        values = (sample_noise(noise, xs, ys) * (1 - wx) * (1 - wy)
+                  + sample_noise(noise, xs - width, ys) * wx * (1 - wy)
+                  + sample_noise(noise, xs, ys - height) * (1 - wx) * wy
+                  + sample_noise(noise, xs - width, ys - height) * wx * wy)
+    else:
+        values = sample_noise(noise, xs, ys)
+
+    return (values + 1.0) / 2.0
+
+FALLOFF_DISTANCES = {
+    "circle": lambda dx, dy: np.sqrt(dx**2 + dy**2),
+    "square": lambda dx, dy: np.maximum(np.abs(dx), np.abs(dy)),
+    "diamond": lambda dx, dy: np.abs(dx) + np.abs(dy),
+}
+
+FALLOFF_CURVES = {
+    "smoothstep": lambda fade: fade * fade * (3.0 - 2.0 * fade),
+    "linear": lambda fade: fade,
+}
+
+def falloff_channel(source, xs, ys, width, height):
     center_x = width / 2.0
     center_y = height / 2.0
     max_dist = width / 2.0
 
-    for x in range(width):
-        for y in range(height):
-            dist = math.sqrt((x - center_x)**2 + (y - center_y)**2)
-            fade = 1.0 - max(0.0, min(1.0, dist / max_dist))
-            alpha_val = fade * fade * (3.0 - 2.0 * fade)
-            alpha_byte = int(alpha_val * 255)
-            pixels[x, y] = (255, 255, 255, alpha_byte)
-    image.save(output_filename)
-    print(f"Success! Image exported to: {output_filename}")
+    dist = FALLOFF_DISTANCES[source["falloff"]](xs - center_x, ys - center_y)
+    fade = 1.0 - np.clip(dist / max_dist, 0.0, 1.0)
+    return FALLOFF_CURVES[source.get("curve", "smoothstep")](fade)
+
+def render_band(spec, y0, y1):
+    """
+    Renders rows y0 to y1 of a texture as an RGBA array.
+    """
+    width, height = spec_size(spec)
+    ys, xs = np.mgrid[y0:y1, 0:width].astype(np.float64)
+
+    pixels = np.zeros((y1 - y0, width, 4), np.uint8)
+    pixels[..., 3] = 255
+
+    for channels, source in spec["channels"].items():
+        if "noise" in source:
+            value = noise_channel(source, xs, ys, width, height)
+        elif "falloff" in source:
+            value = falloff_channel(source, xs, ys, width, height)
+        else:
+            value = np.full(xs.shape, float(source["constant"]))
+
+        color_val = np.clip((value * 255).astype(np.int64), 0, 255).astype(np.uint8)
+        for channel in channels:
+            pixels[..., CHANNELS.index(channel)] = color_val
+
+    return pixels
+
+def build(specs, jobs=None, band_rows=256):
+    start = time.perf_counter()
+
+    images = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {}
+        for spec in specs:
+            width, height = spec_size(spec)
+            images[spec["output"]] = np.empty((height, width, 4), np.uint8)
+            for y0 in range(0, height, band_rows):
+                y1 = min(y0 + band_rows, height)
+                futures[executor.submit(render_band, spec, y0, y1)] = (spec["output"], y0, y1)
+
+        for future in concurrent.futures.as_completed(futures):
+            output, y0, y1 = futures[future]
+            images[output][y0:y1] = future.result()
+
+    for output, pixels in images.items():
+        Image.fromarray(pixels).save(output)
+        print(f"Success! Image exported to: {output}")
+
+    print(f"Built {len(specs)} textures in {time.perf_counter() - start:.2f} s")
 
 if __name__ == "__main__":
-    generate_noise_image()
-    generate_soft_circle_texture()
+    parser = argparse.ArgumentParser(description="Generate the heat distortion noise and soft circle textures, or any set of texture specs.")
+    parser.add_argument("--specs", help="JSON or YAML list of texture specs to build instead of the heat distortion textures")
+    parser.add_argument("--size", type=int, default=512, help="width and height of the noise texture")
+    parser.add_argument("--octaves", type=int, default=4, help="fractal octaves of the noise")
+    parser.add_argument("--frequency", type=float, default=0.01, help="frequency of the noise")
+    parser.add_argument("--seamless", action="store_true", help="make the noise texture tile seamlessly")
+    parser.add_argument("--circle-size", type=int, default=64, help="width and height of the soft circle texture")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (defaults to the CPU count)")
+    parser.add_argument("--band-rows", type=int, default=256, help="rows rendered by each worker task")
+    args = parser.parse_args()
+
+    if args.specs:
+        specs = load_specs(args.specs)
+    else:
+        specs = default_specs(args.size, args.octaves, args.frequency, args.seamless, args.circle_size)
+
+    build(specs, args.jobs, args.band_rows)
@@ -20,67 +20,37 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import PIL
-import PIL.Image
-import sys
+import argparse
 import iconsmooth_lib
 
-if len(sys.argv) != 5:
-    print("iconsmooth.py in.png METRICS <" + iconsmooth_lib.all_conv + "> OUTPREFIX")
-    print("OUTPREFIX is something like, say, " + iconsmooth_lib.explain_prefix)
-    print(iconsmooth_lib.explain_mm)
-    raise Exception("see printed help")
-
-# Input detail configuration
-input_name = sys.argv[1]
-metric_mode = sys.argv[2]
-conversion_mode = sys.argv[3]
-out_prefix = sys.argv[4]
-
-# Metric configuration
-tile_w, tile_h, subtile_w, subtile_h, remtile_w, remtile_h = iconsmooth_lib.parse_metric_mode(metric_mode)
-
-# Output state configuration
-out_states = iconsmooth_lib.conversion_modes[conversion_mode].states
-
-# Source loading
-src_img = PIL.Image.open(input_name)
-
-input_row = src_img.size[0] // tile_w
-
-tiles = []
-# 48 is the amount of tiles that usually exist, but 56 covers walls with diagonal variants.
-for i in range(56):
-    tile = PIL.Image.new("RGBA", (tile_w, tile_h))
-    tx = i % input_row
-    ty = i // input_row
-    tile.paste(src_img, (tx * -tile_w, ty * -tile_h))
-    # now split that up
-    # note that THIS is where the weird ordering gets put into place
-    tile_a = PIL.Image.new("RGBA", (remtile_w, remtile_h))
-    tile_a.paste(tile,           (-subtile_w, -subtile_h))
-    tile_b = PIL.Image.new("RGBA", (subtile_w, subtile_h))
-    tile_b.paste(tile,           (         0,          0))
-    tile_c = PIL.Image.new("RGBA", (remtile_w, subtile_h))
-    tile_c.paste(tile,           (-subtile_w,          0))
-    tile_d = PIL.Image.new("RGBA", (subtile_w, remtile_h))
-    tile_d.paste(tile,           (         0, -subtile_h))
-    tiles.append([tile_a, tile_b, tile_c, tile_d])
-
-state_size = (tile_w * 2, tile_h * 2)
-
-for state in range(len(out_states)):
-    full = PIL.Image.new("RGBA", state_size)
-    full.paste(tiles[out_states[state][0]][0], (subtile_w, subtile_h))
-    full.paste(tiles[out_states[state][1]][1], (tile_w, 0))
-    full.paste(tiles[out_states[state][2]][2], (subtile_w, tile_h))
-    full.paste(tiles[out_states[state][3]][3], (tile_w, tile_h + subtile_h))
-    full.save(out_prefix + str(state) + ".png")
-
-full_finale = PIL.Image.new("RGBA", (tile_w, tile_h))
-full_finale.paste(tiles[out_states[0][0]][0], (subtile_w, subtile_h))
-full_finale.paste(tiles[out_states[0][1]][1], (0, 0))
-full_finale.paste(tiles[out_states[0][2]][2], (subtile_w, 0))
-full_finale.paste(tiles[out_states[0][3]][3], (0, subtile_h))
-full_finale.save(out_prefix + "full.png")
-
+parser = argparse.ArgumentParser(
+    usage="iconsmooth.py in.png METRICS <" + iconsmooth_lib.all_conv + "/" + iconsmooth_lib.all_modes + "> OUTPREFIX",
+    epilog="OUTPREFIX is something like, say, " + iconsmooth_lib.explain_prefix + "\n"
+        + "Mode " + iconsmooth_lib.all_modes + " writes every mode from one pass, to OUTPREFIX + MODE + _\n"
+        + "To convert many sheets in one go, see iconsmooth_batch.py\n"
+        + iconsmooth_lib.explain_mm,
+    formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("input_name", metavar="in.png")
+parser.add_argument("metric_mode", metavar="METRICS")
+parser.add_argument("conversion_mode", metavar="MODE", choices=[*iconsmooth_lib.conversion_modes, iconsmooth_lib.all_modes])
+parser.add_argument("out_prefix", metavar="OUTPREFIX")
+parser.add_argument("--rsi", action="store_true",
+                    help="OUTPREFIX is inside an .rsi directory; also add the states to its meta.json, creating it if needed")
+parser.add_argument("--license", default="CC-BY-SA-3.0",
+                    help="license for a newly created meta.json")
+parser.add_argument("--copyright", default="",
+                    help="copyright for a newly created meta.json")
+parser.add_argument("--cache", default=iconsmooth_lib.explain_cache_default,
+                    help="file remembering previous conversions, so unchanged sheets are skipped")
+parser.add_argument("--force", action="store_true",
+                    help="convert even if the cache says the outputs are up to date")
+
+args = parser.parse_args()
+
+cache = iconsmooth_lib.ConversionCache(args.cache)
+entry, written = iconsmooth_lib.convert_cached(
+    cache.get(args.out_prefix), args.input_name, args.metric_mode, args.conversion_mode, args.out_prefix,
+    force=args.force, rsi=args.rsi, license=args.license, copyright=args.copyright)
+cache.put(args.out_prefix, entry, written is None)
+cache.save()
+print(cache.stats())
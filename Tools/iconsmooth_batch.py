@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2026 Space Wizards Federation
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Runs iconsmooth.py over many source sheets in one interpreter, spread over a process pool.
+
+import argparse
+import concurrent.futures
+import glob
+import os
+import sys
+import time
+import iconsmooth_lib
+
+explain_manifest = """
+- Manifest -
+Each non-empty line of the manifest is one conversion, with the same arguments as iconsmooth.py:
+ in.png METRICS MODE OUTPREFIX
+METRICS and MODE may be "-" to use --metrics and --mode instead. Lines starting with # are ignored.
+
+- Globs -
+Each --glob pattern may match source PNGs or .rsi directories:
+ Resources/Textures/Structures/catwalk.rsi/catwalk.png is written as catwalk.rsi/catwalk_N.png
+ Resources/Textures/Structures/catwalk.rsi uses catwalk.rsi/catwalk.png as above
+"""
+
+def read_manifest(path, default_metrics, default_mode):
+    jobs = []
+    with open(path, "r", encoding="utf-8-sig") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+
+            sp = line.split()
+            if len(sp) != 4:
+                raise ValueError(f"{path}:{line_number}: expected 'in.png METRICS MODE OUTPREFIX', got '{line}'")
+
+            input_name, metric_mode, conversion_mode, out_prefix = sp
+            if metric_mode == "-":
+                metric_mode = default_metrics
+            if conversion_mode == "-":
+                conversion_mode = default_mode
+            jobs.append((input_name, metric_mode, conversion_mode, out_prefix))
+    return jobs
+
+def glob_jobs(pattern, metric_mode, conversion_mode):
+    jobs = []
+    for match in sorted(glob.glob(pattern, recursive=True)):
+        match = match.rstrip("/\\")
+        if os.path.isdir(match) and match.endswith(".rsi"):
+            stem = os.path.basename(match)[:-len(".rsi")]
+            input_name = os.path.join(match, stem + ".png")
+        elif match.endswith(".png"):
+            input_name = match
+        else:
+            continue
+        jobs.append((input_name, metric_mode, conversion_mode, input_name[:-len(".png")] + "_"))
+    return jobs
+
+def run_job(job, entry, **options):
+    start = time.perf_counter()
+    entry, written = iconsmooth_lib.convert_cached(entry, *job, **options)
+    return entry, written, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert many source sheets with iconsmooth in one process pool.",
+        epilog=explain_manifest + iconsmooth_lib.explain_mm,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--manifest", action="append", default=[],
+                        help="file listing conversions, one per line")
+    parser.add_argument("--glob", action="append", default=[],
+                        help="glob pattern (** supported) of source PNGs or .rsi directories")
+    parser.add_argument("--metrics", default="32",
+                        help="METRICS used for globbed files and '-' manifest entries")
+    parser.add_argument("--mode", default="tg", choices=[*iconsmooth_lib.conversion_modes, iconsmooth_lib.all_modes],
+                        help="conversion mode used for globbed files and '-' manifest entries")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="worker processes (defaults to the CPU count)")
+    parser.add_argument("--rsi", action="store_true",
+                        help="output prefixes are inside .rsi directories; also add the states to their meta.json")
+    parser.add_argument("--license", default="CC-BY-SA-3.0",
+                        help="license for newly created meta.json files")
+    parser.add_argument("--copyright", default="",
+                        help="copyright for newly created meta.json files")
+    parser.add_argument("--cache", default=iconsmooth_lib.explain_cache_default,
+                        help="file remembering previous conversions, so unchanged sheets are skipped")
+    parser.add_argument("--force", action="store_true",
+                        help="convert even if the cache says the outputs are up to date")
+
+    args = parser.parse_args()
+
+    jobs = []
+    for manifest in args.manifest:
+        jobs += read_manifest(manifest, args.metrics, args.mode)
+    for pattern in args.glob:
+        jobs += glob_jobs(pattern, args.metrics, args.mode)
+
+    if not jobs:
+        parser.error("nothing to convert, pass --manifest and/or --glob")
+
+    for job in jobs:
+        if job[2] not in iconsmooth_lib.conversion_modes and job[2] != iconsmooth_lib.all_modes:
+            parser.error(f"unknown conversion mode '{job[2]}' for {job[0]}, expected one of {iconsmooth_lib.all_conv}/{iconsmooth_lib.all_modes}")
+
+    cache = iconsmooth_lib.ConversionCache(args.cache)
+    total_written = 0
+    failures = 0
+    start = time.perf_counter()
+
+    # Jobs into the same RSI would race on its meta.json, so workers only write the images,
+    # and each meta.json is updated once here afterwards with the states of every job into it.
+    rsi_jobs = {}
+    results = {}
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        options = {"force": args.force, "rsi": args.rsi, "license": args.license, "copyright": args.copyright,
+                   "write_meta": False}
+        futures = {executor.submit(run_job, job, cache.get(job[3]), **options): i for i, job in enumerate(jobs)}
+        for future in concurrent.futures.as_completed(futures):
+            i = futures[future]
+            input_name, metric_mode, conversion_mode, out_prefix = jobs[i]
+            try:
+                entry, written, elapsed = future.result()
+            except Exception as e:
+                print(f"FAILED {input_name}: {e}", file=sys.stderr)
+                failures += 1
+                continue
+            if written is None:
+                print(f"{elapsed * 1000:8.1f} ms  {input_name} unchanged, skipped")
+            else:
+                total_written += len(written)
+                print(f"{elapsed * 1000:8.1f} ms  {input_name} ({metric_mode}, {conversion_mode}) -> {out_prefix}")
+            results[i] = entry, written
+            if args.rsi and written is not None:
+                rsi_jobs.setdefault(os.path.dirname(out_prefix), []).append(i)
+
+    # Cache entries of jobs into an RSI are only kept once its meta.json lists their states.
+    unwritten = set()
+    for rsi_dir, indices in rsi_jobs.items():
+        indices.sort()
+        state_names = [name for i in indices for name in iconsmooth_lib.rsi_state_names(results[i][1])]
+        try:
+            if iconsmooth_lib.update_rsi_meta(rsi_dir, jobs[indices[0]][1], state_names, args.license, args.copyright):
+                total_written += 1
+        except Exception as e:
+            print(f"FAILED {os.path.join(rsi_dir, 'meta.json')}: {e}", file=sys.stderr)
+            failures += len(indices)
+            unwritten.update(indices)
+
+    for i, (entry, written) in results.items():
+        if i not in unwritten:
+            cache.put(jobs[i][3], entry, written is None)
+
+    cache.save()
+
+    elapsed = time.perf_counter() - start
+    converted = len(jobs) - failures
+    print(f"Processed {converted} sheets ({total_written} files written) in {elapsed:.2f} s: "
+          f"{converted / elapsed:.1f} sheets/s, {total_written / elapsed:.1f} files/s")
+    print(cache.stats())
+
+    if failures:
+        print(f"{failures} sheets failed to convert", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
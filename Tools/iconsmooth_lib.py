@@ -20,11 +20,65 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import contextlib
+import functools
+import glob
+import hashlib
+import io
+import json
+import os
+import tempfile
+import numpy
+import PIL
+import PIL.Image
+
+# Amount of states in a smoothing state table, and quadrants in each state.
+state_count = 8
+quadrant_count = 4
+
 class ConversionMode:
+    """
+    How a source sheet of tw*th tiles maps to output states.
+    Each of the states gives a source tile index (or -1 for none) per quadrant, in BR, TL, TR, BL order.
+    """
     def __init__(self, tw, th, states):
+        for name, value in (("tw", tw), ("th", th)):
+            if type(value) is not int or value < 1:
+                raise ValueError(f"{name} must be a positive integer, got {value!r}")
+        if not isinstance(states, list) or len(states) != state_count:
+            raise ValueError(f"states must be a list of {state_count} states")
+        for i, state in enumerate(states):
+            if not isinstance(state, list) or len(state) != quadrant_count:
+                raise ValueError(f"state {i} must be a list of {quadrant_count} tile indices, got {state!r}")
+            for tile in state:
+                if type(tile) is not int or not -1 <= tile < tw * th:
+                    raise ValueError(f"state {i} has tile index {tile!r}, expected -1 or 0 to {tw * th - 1} for a {tw}x{th} sheet")
+
         self.tw = tw
         self.th = th
         self.states = states
+        # The state table itself is the forward mapping.
+        self.forward = tuple(tuple(state) for state in states)
+
+    @functools.cached_property
+    def referenced(self):
+        """
+        The source tile indices the state table actually uses.
+        """
+        return tuple(sorted({tile for state in self.forward for tile in state}))
+
+    @functools.cached_property
+    def inverse(self):
+        """
+        For each source tile and quadrant, the state it's taken from when inverting, or -1.
+        Where several states use the same source quadrant, the lowest state wins.
+        """
+        inverse = numpy.full((self.tw * self.th, quadrant_count), -1, numpy.int8)
+        for i in reversed(range(len(self.forward))):
+            for j, tile in enumerate(self.forward[i]):
+                if tile != -1:
+                    inverse[tile, j] = i
+        return inverse
 
 conversion_modes = {
     # TG
@@ -143,7 +197,52 @@ conversion_modes = {
     ),
 }
 
-all_conv = "tg/citadel/tau/vxa/vxap/rt_states"
+# Pseudo conversion mode for iconsmooth.py that writes every mode at once.
+all_modes = "all"
+
+def load_conversion_modes(path):
+    """
+    Loads conversion modes from a JSON or YAML file, mapping each mode name to its tw, th and states, e.g.:
+
+    my_format:
+      tw: 3
+      th: 2
+      states:
+        - [0, 0, 0, 0]
+        - ...
+
+    Modes are validated here, so a broken file fails up front rather than mid-conversion.
+    """
+    with open(path, "r", encoding="utf-8-sig") as f:
+        if path.endswith(".json"):
+            data = json.load(f)
+        else:
+            import yaml
+            data = yaml.safe_load(f)
+
+    if not isinstance(data, dict):
+        raise ValueError(f"{path}: expected a mapping of mode names to modes")
+
+    modes = {}
+    for name, mode in data.items():
+        if name == all_modes:
+            raise ValueError(f"{path}: '{all_modes}' is reserved")
+        try:
+            modes[name] = ConversionMode(mode["tw"], mode["th"], mode["states"])
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"{path}: mode '{name}' is invalid: {e!r}") from e
+    return modes
+
+# Extra conversion modes are loaded from iconsmooth_modes/*.json/yml next to this file,
+# and from any files listed in SS14_ICONSMOOTH_MODES (separated like PATH). Later files override earlier modes.
+mode_files = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "iconsmooth_modes", "*.*")))
+mode_files += [path for path in os.environ.get("SS14_ICONSMOOTH_MODES", "").split(os.pathsep) if path]
+
+for mode_file in mode_files:
+    if mode_file.endswith((".json", ".yml", ".yaml")):
+        conversion_modes.update(load_conversion_modes(mode_file))
+
+all_conv = "/".join(conversion_modes)
 
 def parse_size(sz):
     if sz.find("x") == -1:
@@ -195,3 +294,426 @@ REM is computed from subtracting the subtile size from the tile size.
 
 explain_prefix = "Resources/Textures/Structures/catwalk.rsi/catwalk_"
 
+# 48 is the amount of tiles that usually exist, but 56 covers walls with diagonal variants.
+source_tile_count = 56
+
+# - Slicing engine -
+# Images are handled as (height, width, 4) RGBA uint8 arrays.
+# Quadrants are handed out as views into the loaded sheet, so nothing is copied until a state is assembled.
+
+def load_rgba(src):
+    """
+    Loads a file name or PIL image as an RGBA array.
+    """
+    if isinstance(src, PIL.Image.Image):
+        return numpy.asarray(src.convert("RGBA"))
+    with PIL.Image.open(src) as img:
+        return numpy.asarray(img.convert("RGBA"))
+
+def save_rgba(arr, name):
+    PIL.Image.fromarray(arr).save(name)
+
+def crop_padded(arr, x, y, w, h):
+    """
+    Returns the w*h region at x, y of arr.
+    Anything outside of arr is transparent, same as pasting into a new PIL image at a negative offset.
+    """
+    if x >= 0 and y >= 0 and x + w <= arr.shape[1] and y + h <= arr.shape[0]:
+        return arr[y:y + h, x:x + w]
+    out = numpy.zeros((h, w, 4), numpy.uint8)
+    paste(out, arr, -x, -y)
+    return out
+
+def paste(dst, src, x, y):
+    """
+    Copies src into dst at x, y, clipped to dst.
+    """
+    dx0 = max(x, 0)
+    dy0 = max(y, 0)
+    dx1 = min(x + src.shape[1], dst.shape[1])
+    dy1 = min(y + src.shape[0], dst.shape[0])
+    if dx1 > dx0 and dy1 > dy0:
+        dst[dy0:dy1, dx0:dx1] = src[dy0 - y:dy1 - y, dx0 - x:dx1 - x]
+
+def quadrant_rects(metric_mode):
+    """
+    The (x, y, w, h) of each quadrant within a tile, in state table order (BR, TL, TR, BL).
+    """
+    tile_w, tile_h, subtile_w, subtile_h, remtile_w, remtile_h = parse_metric_mode(metric_mode)
+    # note that THIS is where the weird ordering gets put into place
+    return [
+        (subtile_w, subtile_h, remtile_w, remtile_h), # A
+        (        0,         0, subtile_w, subtile_h), # B
+        (subtile_w,         0, remtile_w, subtile_h), # C
+        (        0, subtile_h, subtile_w, remtile_h), # D
+    ]
+
+def state_offsets(metric_mode):
+    """
+    The (x, y) of each quadrant within an output state image, in state table order.
+    """
+    tile_w, tile_h, subtile_w, subtile_h, remtile_w, remtile_h = parse_metric_mode(metric_mode)
+    return [
+        (subtile_w, subtile_h),
+        (   tile_w,         0),
+        (subtile_w,    tile_h),
+        (   tile_w, tile_h + subtile_h),
+    ]
+
+class SubtileSheet:
+    """
+    A source sheet loaded once, split into tiles and their A/B/C/D quadrants.
+    src is a file name, PIL image or RGBA array.
+    Only the given tile indices are sliced, and the sheet is only decoded as far down as the last of them.
+    """
+    def __init__(self, src, metric_mode, tiles=range(source_tile_count)):
+        tile_w, tile_h = parse_metric_mode(metric_mode)[:2]
+        self.rects = quadrant_rects(metric_mode)
+
+        if isinstance(src, numpy.ndarray):
+            input_row = src.shape[1] // tile_w
+            pixels = src
+        else:
+            input_row, pixels = self._decode(src, tile_w, tile_h, tiles)
+
+        # Tiles hanging off the sheet come out transparent.
+        self.tiles = {}
+        for index in tiles:
+            tx = (index % input_row) * tile_w
+            ty = (index // input_row) * tile_h
+            self.tiles[index] = crop_padded(pixels, tx, ty, tile_w, tile_h)
+
+    @staticmethod
+    def _decode(src, tile_w, tile_h, tiles):
+        with contextlib.nullcontext(src) if isinstance(src, PIL.Image.Image) else PIL.Image.open(src) as img:
+            input_row = img.size[0] // tile_w
+            rows = max(tiles, default=-1) // input_row + 1
+            # Crop to the image bounds: cropping past them would fill with palette index 0 rather than transparency.
+            return input_row, load_rgba(img.crop((0, 0, input_row * tile_w, min(rows * tile_h, img.size[1]))))
+
+    def tile(self, index):
+        return self.tiles[index]
+
+    def quadrant(self, index, quadrant):
+        x, y, w, h = self.rects[quadrant]
+        return self.tiles[index][y:y + h, x:x + w]
+
+def assemble_state(sheet, metric_mode, state):
+    """
+    Builds a 4-direction output state from the source tiles given by a row of a state table.
+    """
+    tile_w, tile_h = parse_metric_mode(metric_mode)[:2]
+    out = numpy.zeros((tile_h * 2, tile_w * 2, 4), numpy.uint8)
+    for quadrant, (x, y) in enumerate(state_offsets(metric_mode)):
+        paste(out, sheet.quadrant(state[quadrant], quadrant), x, y)
+    return out
+
+def assemble_full(sheet, metric_mode, state):
+    """
+    Builds a single-tile preview from a row of a state table, with every quadrant in its natural place.
+    """
+    tile_w, tile_h = parse_metric_mode(metric_mode)[:2]
+    out = numpy.zeros((tile_h, tile_w, 4), numpy.uint8)
+    for quadrant, (x, y, w, h) in enumerate(quadrant_rects(metric_mode)):
+        paste(out, sheet.quadrant(state[quadrant], quadrant), x, y)
+    return out
+
+def slice_state(src, metric_mode):
+    """
+    Splits an output state image back into its quadrants, in state table order.
+    """
+    pixels = load_rgba(src)
+    rects = quadrant_rects(metric_mode)
+    return [crop_padded(pixels, x, y, rects[quadrant][2], rects[quadrant][3])
+            for quadrant, (x, y) in enumerate(state_offsets(metric_mode))]
+
+def assemble_source(state_quadrants, metric_mode, conversion_mode):
+    """
+    Inverts a conversion: builds a source sheet from the sliced quadrants of each output state.
+    Where several states use the same source quadrant, the lowest state wins.
+    """
+    tile_w, tile_h = parse_metric_mode(metric_mode)[:2]
+    rects = quadrant_rects(metric_mode)
+
+    out = numpy.zeros((tile_h * conversion_mode.th, tile_w * conversion_mode.tw, 4), numpy.uint8)
+    for target_tile, target_states in enumerate(conversion_mode.inverse):
+        target_stx = (target_tile % conversion_mode.tw) * tile_w
+        target_sty = (target_tile // conversion_mode.tw) * tile_h
+        for j, i in enumerate(target_states):
+            if i != -1:
+                paste(out, state_quadrants[i][j], target_stx + rects[j][0], target_sty + rects[j][1])
+    return out
+
+def encode_png(arr):
+    out = io.BytesIO()
+    PIL.Image.fromarray(arr).save(out, format="PNG")
+    return out.getvalue()
+
+def write_file(name, data):
+    """
+    Writes a whole file in one go, via a synced temporary file so a crash never leaves a half-written output behind.
+    Files that already hold exactly this data are left alone.
+    """
+    try:
+        if os.path.getsize(name) == len(data):
+            with open(name, "rb") as f:
+                if f.read() == data:
+                    return
+    except FileNotFoundError:
+        pass
+
+    # A unique temporary name, as other processes may be writing the same file.
+    fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(name) or ".", prefix=os.path.basename(name) + ".", suffix=".tmp")
+    try:
+        # mkstemp makes the file private, give it the permissions a plain open() would have.
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_name, 0o666 & ~umask)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_name, name)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_name)
+        raise
+
+def write_states(sheet, metric_mode, out_states, out_prefix, encoded=None):
+    """
+    Writes out_prefix + N.png for each state and out_prefix + full.png.
+    encoded caches PNG data by state row, so identical states (within or across modes) are only assembled and encoded once.
+    Returns the names of the images written.
+    """
+    if encoded is None:
+        encoded = {}
+
+    def write(kind, state, name):
+        key = (kind, tuple(state))
+        if key not in encoded:
+            assemble = assemble_state if kind == "state" else assemble_full
+            encoded[key] = encode_png(assemble(sheet, metric_mode, state))
+        write_file(name, encoded[key])
+        return name
+
+    written = [write("state", out_states[state], out_prefix + str(state) + ".png") for state in range(len(out_states))]
+    written.append(write("full", out_states[0], out_prefix + "full.png"))
+    return written
+
+def load_rsi_meta(rsi_dir, metric_mode, license, copyright):
+    """
+    Loads the meta.json of an RSI, checking it fits the metrics, or makes a new one with the given license and copyright.
+    """
+    tile_w, tile_h = parse_metric_mode(metric_mode)[:2]
+    meta_path = os.path.join(rsi_dir, "meta.json")
+
+    if not os.path.exists(meta_path):
+        return {
+            "version": 1,
+            "license": license,
+            "copyright": copyright,
+            "size": {"x": tile_w, "y": tile_h},
+            "states": [],
+        }
+
+    with open(meta_path, "r", encoding="utf-8-sig") as f:
+        meta = json.load(f)
+    if meta["size"] != {"x": tile_w, "y": tile_h}:
+        raise ValueError(f"{meta_path} has size {meta['size']['x']}x{meta['size']['y']}, but METRICS is {tile_w}x{tile_h}")
+    return meta
+
+def rsi_state_names(state_files):
+    """
+    The RSI state names of the given state images, in order.
+    """
+    return [os.path.basename(state_file)[:-len(".png")] for state_file in state_files if state_file.endswith(".png")]
+
+def meta_indent(meta_path):
+    """
+    The indent an existing meta.json uses, so rewriting it doesn't reformat the whole file.
+    """
+    try:
+        with open(meta_path, "r", encoding="utf-8-sig") as f:
+            for line in f.read().splitlines()[1:]:
+                if line.strip():
+                    return line[:len(line) - len(line.lstrip())] or None
+    except FileNotFoundError:
+        pass
+    # Most metas in the repo use 4 spaces.
+    return "    "
+
+def write_rsi_meta(rsi_dir, meta, state_names):
+    """
+    Adds the given states to an RSI's meta and writes it out, if that changes anything.
+    Existing states with other names are kept. Returns the path of the meta.json, or None if it was already up to date.
+    """
+    states = {state["name"]: state for state in meta["states"]}
+    for name in state_names:
+        # The previews are a single tile, the rest hold all 4 directions.
+        states[name] = {"name": name} if name.endswith("full") else {"name": name, "directions": 4}
+    meta_path = os.path.join(rsi_dir, "meta.json")
+    if list(states.values()) == meta["states"] and os.path.exists(meta_path):
+        return None
+    meta["states"] = list(states.values())
+
+    text = json.dumps(meta, indent=meta_indent(meta_path), ensure_ascii=False) + "\n"
+    write_file(meta_path, text.encode("utf-8"))
+    return meta_path
+
+def update_rsi_meta(rsi_dir, metric_mode, state_names, license="", copyright=""):
+    """
+    Loads (or makes) an RSI's meta.json and adds the given states to it, see write_rsi_meta.
+    """
+    return write_rsi_meta(rsi_dir, load_rsi_meta(rsi_dir, metric_mode, license, copyright), state_names)
+
+quadrant_names = ["BR", "TL", "TR", "BL"]
+
+def verify(input_prefix, metric_mode, conversion_mode):
+    """
+    Round-trips existing states (input_prefix + N.png) through the inverse and then the forward conversion, in memory.
+    Returns (state, quadrant, differing pixel count) for every quadrant that doesn't survive the round trip,
+    i.e. the states can't all be generated from a single source sheet in this mode.
+    """
+    mode = conversion_modes[conversion_mode]
+    state_quadrants = [slice_state(input_prefix + str(j) + ".png", metric_mode) for j in range(len(mode.forward))]
+    sheet = SubtileSheet(assemble_source(state_quadrants, metric_mode, mode), metric_mode, mode.referenced)
+
+    mismatches = []
+    for i, state in enumerate(mode.forward):
+        for j in range(4):
+            if state[j] == -1:
+                continue
+            differing = numpy.any(state_quadrants[i][j] != sheet.quadrant(state[j], j), axis=2)
+            count = numpy.count_nonzero(differing)
+            if count:
+                mismatches.append((i, j, count))
+    return mismatches
+
+def convert(input_name, metric_mode, conversion_mode, out_prefix, rsi=False, license="", copyright="", write_meta=True):
+    """
+    Converts a single source sheet into smoothing states, written as out_prefix + N.png and out_prefix + full.png.
+    With conversion_mode "all", every mode is written from the one decoded sheet, as out_prefix + MODE + "_" + N.png.
+    With rsi, out_prefix must be inside an .rsi directory, which gets the states added to its meta.json.
+    license and copyright are only used if a new meta.json has to be made.
+    Without write_meta, the meta.json is only checked and left to the caller to update, e.g. once for many conversions
+    into the same RSI.
+    Returns the names of the files written.
+    """
+    if conversion_mode == all_modes:
+        out_prefixes = {mode: out_prefix + mode + "_" for mode in conversion_modes}
+    else:
+        out_prefixes = {conversion_mode: out_prefix}
+
+    rsi_dir = os.path.dirname(out_prefix)
+    if rsi:
+        if not rsi_dir.endswith(".rsi"):
+            raise ValueError(f"RSI output needs OUTPREFIX to be inside an .rsi directory, got {out_prefix}")
+        os.makedirs(rsi_dir, exist_ok=True)
+        meta = load_rsi_meta(rsi_dir, metric_mode, license, copyright)
+
+    # Source loading, only cutting out the tiles these modes use
+    tiles = set()
+    for mode in out_prefixes:
+        tiles.update(conversion_modes[mode].referenced)
+    sheet = SubtileSheet(input_name, metric_mode, sorted(tiles))
+
+    encoded = {}
+    written = []
+    for mode, prefix in out_prefixes.items():
+        written += write_states(sheet, metric_mode, conversion_modes[mode].forward, prefix, encoded)
+
+    if rsi and write_meta:
+        meta_path = write_rsi_meta(rsi_dir, meta, rsi_state_names(written))
+        if meta_path is not None:
+            written.append(meta_path)
+    return written
+
+# Bump this whenever the output of convert() changes, so cached conversions are redone.
+tool_version = 1
+
+explain_cache_default = ".iconsmooth_cache.json"
+
+def cache_key(input_name, metric_mode, conversion_mode, rsi):
+    with open(input_name, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    # Modes can be loaded from files, so the tables themselves are part of the key too.
+    modes = conversion_modes if conversion_mode == all_modes else [conversion_mode]
+    tables = [[mode, conversion_modes[mode].tw, conversion_modes[mode].th, conversion_modes[mode].states] for mode in modes]
+    return [digest, metric_mode, conversion_mode, tables, rsi, tool_version]
+
+def output_stamps(names):
+    """
+    Size and modification time of each output.
+    """
+    stamps = {}
+    for name in names:
+        st = os.stat(name)
+        stamps[name] = [st.st_size, st.st_mtime_ns]
+    return stamps
+
+def rsi_has_states(rsi_dir, state_names):
+    """
+    Whether the meta.json of an RSI lists all the given states. Other conversions into the same RSI rewrite it,
+    so a cached conversion checks its own states are still there rather than the file being untouched.
+    """
+    try:
+        with open(os.path.join(rsi_dir, "meta.json"), "r", encoding="utf-8-sig") as f:
+            meta = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return False
+    return set(state_names) <= {state.get("name") for state in meta.get("states", [])}
+
+class ConversionCache:
+    """
+    On-disk record of previous conversions, keyed by output prefix.
+    A conversion is skipped when the input hash, METRICS, mode and tool version match and its outputs are untouched;
+    for RSI output, its states must also still be listed in the meta.json.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+
+    def get(self, out_prefix):
+        return self.entries.get(os.path.abspath(out_prefix))
+
+    def put(self, out_prefix, entry, hit):
+        self.entries[os.path.abspath(out_prefix)] = entry
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def save(self):
+        write_file(self.path, json.dumps(self.entries, indent=1, sort_keys=True).encode("utf-8"))
+
+    def stats(self):
+        total = self.hits + self.misses
+        return f"Cache: {self.hits}/{total} conversions skipped as unchanged, {self.misses} converted ({self.path})"
+
+def convert_cached(entry, input_name, metric_mode, conversion_mode, out_prefix, force=False, **options):
+    """
+    convert(), unless the cache entry from a previous run shows the outputs are already up to date.
+    Returns the new cache entry and the names of the files written, or None if the conversion was skipped.
+    """
+    rsi = options.get("rsi", False)
+    key = cache_key(input_name, metric_mode, conversion_mode, rsi)
+    if entry is not None and not force and entry["key"] == key:
+        try:
+            if output_stamps(entry["outputs"]) == entry["outputs"] and \
+                    (not rsi or "states" in entry and rsi_has_states(os.path.dirname(out_prefix), entry["states"])):
+                return entry, None
+        except FileNotFoundError:
+            pass
+
+    written = convert(input_name, metric_mode, conversion_mode, out_prefix, **options)
+    outputs = [os.path.abspath(name) for name in written if os.path.basename(name) != "meta.json"]
+    entry = {"key": key, "outputs": output_stamps(outputs)}
+    if rsi:
+        entry["states"] = rsi_state_names(written)
+    return entry, written
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2026 Space Wizards Federation
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Checks that smoothing states survive iconsmooth_inv.py followed by iconsmooth.py unchanged,
+# i.e. that they can all be generated from one source sheet in the given mode.
+
+import argparse
+import concurrent.futures
+import glob
+import json
+import os
+import sys
+import time
+import PIL
+import PIL.Image
+import iconsmooth_lib
+
+def find_state_prefixes(rsi_dir, state_count):
+    """
+    Finds the prefixes of smoothing state sets in an RSI: 4-directional states named PREFIX0 to PREFIX7.
+    """
+    with open(os.path.join(rsi_dir, "meta.json"), "r", encoding="utf-8-sig") as f:
+        meta = json.load(f)
+
+    directional = {state["name"] for state in meta["states"] if state.get("directions", 1) == 4}
+    prefixes = []
+    for name in sorted(directional):
+        if not name.endswith("0"):
+            continue
+        prefix = name[:-1]
+        if all(prefix + str(i) in directional for i in range(state_count)):
+            prefixes.append(os.path.join(rsi_dir, prefix))
+    return prefixes
+
+def infer_metric_mode(input_prefix):
+    # States are 2x2 tiles, one per direction.
+    with PIL.Image.open(input_prefix + "0.png") as img:
+        return f"{img.size[0] // 2}x{img.size[1] // 2}"
+
+def run_verify(input_prefix, metric_mode, conversion_mode):
+    if metric_mode is None:
+        metric_mode = infer_metric_mode(input_prefix)
+    return metric_mode, iconsmooth_lib.verify(input_prefix, metric_mode, conversion_mode)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that smoothing states round-trip through iconsmooth_inv.py and iconsmooth.py losslessly.",
+        epilog="INPREFIX is something like, say, " + iconsmooth_lib.explain_prefix + "\n" + iconsmooth_lib.explain_mm,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input_prefixes", metavar="INPREFIX", nargs="*")
+    parser.add_argument("--glob", action="append", default=[],
+                        help="glob pattern (** supported) of .rsi directories to check every smoothing state set in")
+    parser.add_argument("--metrics", default=None,
+                        help="METRICS of the states (defaults to half the size of each state image)")
+    parser.add_argument("--mode", default="tg", choices=iconsmooth_lib.conversion_modes.keys())
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="worker processes (defaults to the CPU count)")
+
+    args = parser.parse_args()
+
+    state_count = len(iconsmooth_lib.conversion_modes[args.mode].states)
+    input_prefixes = list(args.input_prefixes)
+    for pattern in args.glob:
+        for match in sorted(glob.glob(pattern, recursive=True)):
+            match = match.rstrip("/\\")
+            if match.endswith(".rsi") and os.path.isfile(os.path.join(match, "meta.json")):
+                input_prefixes += find_state_prefixes(match, state_count)
+
+    if not input_prefixes:
+        parser.error("nothing to verify, pass INPREFIX and/or --glob")
+
+    failures = 0
+    start = time.perf_counter()
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {executor.submit(run_verify, prefix, args.metrics, args.mode): prefix for prefix in input_prefixes}
+        for future in concurrent.futures.as_completed(futures):
+            input_prefix = futures[future]
+            try:
+                metric_mode, mismatches = future.result()
+            except Exception as e:
+                print(f"FAILED {input_prefix}: {e}", file=sys.stderr)
+                failures += 1
+                continue
+
+            if not mismatches:
+                continue
+
+            failures += 1
+            print(f"{input_prefix} ({metric_mode}, {args.mode}) does not round-trip:")
+            for state, quadrant, count in mismatches:
+                print(f"  state {state} {iconsmooth_lib.quadrant_names[quadrant]}: {count} pixels differ")
+
+    elapsed = time.perf_counter() - start
+    print(f"Verified {len(input_prefixes)} state sets in {elapsed:.2f} s, {failures} failed")
+
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,7 +3,15 @@
 # dungeon room pack configs.
 
 import argparse
+import collections
+import concurrent.futures
 import cv2
+import glob
+import itertools
+import numpy as np
+import os
+import sys
+import time
 from dataclasses import dataclass
 
 
@@ -13,23 +21,122 @@ MAX_VALUE = 256
 
 assert(MAX_VALUE % SUBDIVISIONS == 0)
 
-@dataclass
 class Box2:
-    left: int
-    bottom: int
-    right: int
-    top: int
+    """
+    A room, as a view of one (left, bottom, right, top) row of a room array.
+    Changing the box changes the array it views.
+    """
+    __slots__ = ("row",)
+
+    def __init__(self, left, bottom, right, top):
+        self.row = np.array([left, bottom, right, top], np.int32)
+
+    @classmethod
+    def view(cls, row):
+        box = cls.__new__(cls)
+        box.row = row
+        return box
+
+    def _field(index):
+        def get(self):
+            return int(self.row[index])
+
+        def set(self, value):
+            self.row[index] = value
+
+        return property(get, set)
+
+    left = _field(0)
+    bottom = _field(1)
+    right = _field(2)
+    top = _field(3)
+    del _field
+
+    def __eq__(self, other):
+        return isinstance(other, Box2) and bool((self.row == other.row).all())
+
+    def __repr__(self):
+        return f"Box2(left={self.left}, bottom={self.bottom}, right={self.right}, top={self.top})"
 
 @dataclass
 class RoomPackBitmap:
     width: int
     height: int
-    rooms: list
-
-
-def analyze_bitmap(fname, centered = False, offset_x = 0, offset_y = 0):
-    image = cv2.imread(fname, cv2.IMREAD_GRAYSCALE)
-
+    # N x 4 int32 array of (left, bottom, right, top)
+    boxes: np.ndarray
+
+    @property
+    def rooms(self):
+        return [Box2.view(row) for row in self.boxes]
+
+
+def find_conflicts(boxes):
+    """
+    Finds every pair of conflicting rooms as (kind, i, j): "duplicate", "contains" (room i contains room j)
+    or "overlaps". Rooms are half-open, so rooms that only share an edge don't conflict.
+    Rooms are bucketed into a uniform grid sized to the typical room, so only rooms sharing a cell are compared.
+    """
+    if len(boxes) == 0:
+        return []
+
+    sizes = np.maximum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1])
+    cell = max(1, int(np.partition(sizes, len(sizes) // 2)[len(sizes) // 2]))
+    first_cells = boxes[:, :2] // cell
+    last_cells = np.maximum(boxes[:, :2], boxes[:, 2:] - 1) // cell
+
+    cells = collections.defaultdict(list)
+    for i, (cx0, cy0, cx1, cy1) in enumerate(np.hstack([first_cells, last_cells]).tolist()):
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                cells[(cx, cy)].append(i)
+
+    pairs = set()
+    for bucket in cells.values():
+        pairs.update(itertools.combinations(bucket, 2))
+    if not pairs:
+        return []
+
+    pairs = np.array(sorted(pairs), np.int64)
+    a = boxes[pairs[:, 0]]
+    b = boxes[pairs[:, 1]]
+
+    overlaps = (a[:, 0] < b[:, 2]) & (b[:, 0] < a[:, 2]) & (a[:, 1] < b[:, 3]) & (b[:, 1] < a[:, 3])
+    duplicate = (a == b).all(axis=1)
+    a_contains = (a[:, :2] <= b[:, :2]).all(axis=1) & (b[:, 2:] <= a[:, 2:]).all(axis=1)
+    b_contains = (b[:, :2] <= a[:, :2]).all(axis=1) & (a[:, 2:] <= b[:, 2:]).all(axis=1)
+
+    conflicts = []
+    for n in np.flatnonzero(overlaps):
+        i, j = int(pairs[n, 0]), int(pairs[n, 1])
+        if duplicate[n]:
+            conflicts.append(("duplicate", i, j))
+        elif a_contains[n]:
+            conflicts.append(("contains", i, j))
+        elif b_contains[n]:
+            conflicts.append(("contains", j, i))
+        else:
+            conflicts.append(("overlaps", i, j))
+
+    conflicts.sort(key=lambda c: (c[1], c[2]))
+    return conflicts
+
+
+def dedupe_rooms(boxes, conflicts):
+    """
+    Drops later duplicates and rooms contained in other rooms, like the hole contours findContours reports.
+    Returns the kept rooms and the indices of the dropped ones.
+    """
+    removed = {j for kind, i, j in conflicts if kind in ("duplicate", "contains")}
+    keep = np.ones(len(boxes), bool)
+    keep[list(removed)] = False
+    return boxes[keep], removed
+
+
+def find_rects_threshold(image):
+    """
+    Bounding rects (N x 4 x, y, w, h) of every contour in every grey band,
+    thresholding and scanning the whole image once per band.
+    """
     contours = []
 
     for i in range(0, 1 + SUBDIVISIONS):
@@ -48,33 +155,179 @@ def analyze_bitmap(fname, centered = False, offset_x = 0, offset_y = 0):
 
         contours += new_contours[0:-1]
 
+    rects = np.empty((sum(len(contour) for contour in contours), 4), np.int32)
+    n = 0
+    for contour in contours:
+        for subcontour in contour:
+            rects[n] = cv2.boundingRect(subcontour)
+            n += 1
+
+    return rects
+
+
+# Grey value -> band, matching the bounds find_rects_threshold uses: band i holds values from
+# MAX_VALUE / SUBDIVISIONS * (i - 1) to MAX_VALUE / SUBDIVISIONS * i - 1, and values below MIN_VALUE are ignored.
+BAND_LUT = np.array([value // (MAX_VALUE // SUBDIVISIONS) + 1 if value >= MIN_VALUE else 0
+                     for value in range(256)], np.uint8)
+
+
+def find_rects_bands(image):
+    """
+    Same rects as find_rects_threshold, but the image is quantized into bands once, and contours are only
+    traced for the bands actually present, each within its own bounding box.
+    """
+    bands = cv2.LUT(image, BAND_LUT)
+    histogram = cv2.calcHist([bands], [0], None, [256], [0, 256]).ravel()
+
+    band_rects = []
+    for band in np.flatnonzero(histogram[1:]) + 1:
+        mask = cv2.inRange(bands, int(band), int(band))
+        x, y, w, h = cv2.boundingRect(mask)
+        contours = cv2.findContours(mask[y:y + h, x:x + w], cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE, offset=(x, y))[0]
+
+        rects = np.empty((len(contours), 4), np.int32)
+        for n, contour in enumerate(contours):
+            rects[n] = cv2.boundingRect(contour)
+        band_rects.append(rects)
+
+    return np.concatenate(band_rects) if band_rects else np.empty((0, 4), np.int32)
+
+
+FIND_RECTS = {
+    "bands": find_rects_bands,
+    "threshold": find_rects_threshold,
+}
+
+
+def analyze_bitmap(fname, centered = False, offset_x = 0, offset_y = 0, method = "bands"):
+    image = cv2.imread(fname, cv2.IMREAD_GRAYSCALE)
+
+    rects = FIND_RECTS[method](image)
+
     image_height = len(image)
     image_width = len(image[0])
-    rooms = []
 
     if centered:
         offset_x -= image_width // 2
         offset_y -= image_height // 2
 
-    for contour in contours:
-        for subcontour in contour:
-            x, y, w, h = cv2.boundingRect(subcontour)
+    # x, y, w, h -> left, bottom, right, top, offset all at once.
+    boxes = rects
+    boxes[:, 2:] += boxes[:, :2]
+    boxes += np.array([offset_x, offset_y, offset_x, offset_y], np.int32)
+
+    return RoomPackBitmap(image_width, image_height, boxes)
 
-            box = Box2(offset_x + x,
-                       offset_y + y,
-                       offset_x + x + w,
-                       offset_y + y + h)
 
-            rooms.append(box)
+def benchmark(fname, runs):
+    image = cv2.imread(fname, cv2.IMREAD_GRAYSCALE)
 
-    return RoomPackBitmap(image_width, image_height, rooms)
+    results = {}
+    for method, find_rects in FIND_RECTS.items():
+        start = time.perf_counter()
+        for _ in range(runs):
+            results[method] = find_rects(image)
+        elapsed = (time.perf_counter() - start) / runs
+        print(f"{method:>10}: {elapsed * 1000:9.2f} ms per run, {len(results[method])} rooms")
+
+    if not np.array_equal(results["bands"], results["threshold"]):
+        raise RuntimeError("bands and threshold methods found different rooms")
+    print("Both methods found identical rooms.")
+
+
+def describe_conflicts(boxes, conflicts, removed):
+    """
+    A line for each conflict left after dropping the removed rooms.
+    """
+    lines = []
+    for kind, i, j in conflicts:
+        if i in removed or j in removed:
+            continue
+        a = ",".join(map(str, boxes[i].tolist()))
+        b = ",".join(map(str, boxes[j].tolist()))
+        lines.append(f"room {a} {kind} room {b}")
+
+    if removed:
+        lines.append(f"dropped {len(removed)} duplicate or contained rooms")
+    return lines
+
+
+def analyze_checked(fname, centered, offset_x, offset_y, method, dedupe):
+    """
+    Analyzes a bitmap and checks its rooms for conflicts, optionally deduplicating them.
+    Returns the result, a description of the conflicts, how many are left in the result, and the time taken.
+    """
+    start = time.perf_counter()
+    result = analyze_bitmap(fname, centered, offset_x, offset_y, method)
+    conflicts = find_conflicts(result.boxes)
+
+    boxes = result.boxes
+    removed = set()
+    if dedupe:
+        result.boxes, removed = dedupe_rooms(boxes, conflicts)
+
+    remaining = sum(1 for _, i, j in conflicts if i not in removed and j not in removed)
+    return result, describe_conflicts(boxes, conflicts, removed), remaining, time.perf_counter() - start
+
+
+def format_room_pack(pack_id, result):
+    """
+    A dungeonRoomPack prototype for the analyzed bitmap, laid out like Resources/Prototypes/Procedural/dungeon_room_packs.yml.
+    """
+    lines = [
+        "- type: dungeonRoomPack",
+        f"  id: {pack_id}",
+        f"  size: {result.width},{result.height}",
+        # A bare "rooms:" would be null, not an empty list.
+        "  rooms:" if len(result.boxes) else "  rooms: []",
+    ]
+
+    for left, bottom, right, top in result.boxes.tolist():
+        lines.append(f"    - {left},{bottom},{right},{top}")
+
+    return "\n".join(lines) + "\n"
+
+
+def expand_files(patterns):
+    files = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            files += sorted(glob.glob(pattern, recursive=True))
+        else:
+            files.append(pattern)
+    return files
+
+
+def analyze_batch(files, args):
+    """
+    Analyzes every bitmap in a process pool and returns the room pack YAML for all of them, in input order.
+    """
+    start = time.perf_counter()
+    packs = []
+    remaining = 0
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = [executor.submit(analyze_checked, fname, args.center, args.offset[0], args.offset[1], args.method, args.dedupe)
+                   for fname in files]
+
+        for fname, future in zip(files, futures):
+            result, problems, conflicts, elapsed = future.result()
+            for problem in problems:
+                print(f"{fname}: {problem}", file=sys.stderr)
+            remaining += conflicts
+            pack_id = args.id_prefix + os.path.splitext(os.path.basename(fname))[0]
+            packs.append(format_room_pack(pack_id, result))
+            print(f"{fname}: {len(result.boxes)} rooms in {elapsed * 1000:.1f} ms", file=sys.stderr)
+
+    print(f"Analyzed {len(files)} bitmaps in {time.perf_counter() - start:.2f} s.", file=sys.stderr)
+    return "\n".join(packs), remaining
 
 
 def main():
     parser = argparse.ArgumentParser(description='Calculate rooms from a greyscale bitmap')
 
-    parser.add_argument('file', type=str,
-                        help='a greyscale bitmap')
+    parser.add_argument('file', type=str, nargs='+',
+                        help='greyscale bitmaps, or glob patterns of them')
 
     parser.add_argument('--center', action=argparse.BooleanOptionalAction,
                         default=False,
@@ -85,20 +338,71 @@ def main():
                         default=[0, 0],
                         help='offset the output coordinates')
 
+    parser.add_argument('--method', choices=FIND_RECTS.keys(),
+                        default='bands',
+                        help='bands quantizes the image once and only traces the grey bands present, '
+                             'threshold scans the whole image once per possible band')
+
+    parser.add_argument('--benchmark', type=int, metavar='RUNS',
+                        help='time both methods over RUNS runs and check they agree, instead of printing rooms')
+
+    parser.add_argument('--output', type=str,
+                        help='write a dungeonRoomPack prototype for every bitmap to this YAML file')
+
+    parser.add_argument('--id-prefix', type=str,
+                        default='',
+                        help='prefix for prototype IDs, which are otherwise the bitmap file names')
+
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='worker processes for analyzing many bitmaps (defaults to the CPU count)')
+
+    parser.add_argument('--dedupe', action=argparse.BooleanOptionalAction,
+                        default=False,
+                        help='drop duplicate rooms and rooms contained in other rooms')
+
+    parser.add_argument('--strict', action=argparse.BooleanOptionalAction,
+                        default=False,
+                        help='exit with an error if any rooms still overlap, are duplicated or are contained in others')
+
     args = parser.parse_args()
 
-    result = analyze_bitmap(args.file, args.center, args.offset[0], args.offset[1])
+    files = expand_files(args.file)
+    if not files:
+        parser.error("no bitmaps matched")
+
+    if args.benchmark:
+        for fname in files:
+            print(fname)
+            benchmark(fname, args.benchmark)
+        return
+
+    if args.output or len(files) > 1:
+        yaml, conflicts = analyze_batch(files, args)
+        if not args.output:
+            print(yaml, end="")
+        else:
+            with open(args.output, "w", encoding="utf-8", newline="\n") as f:
+                f.write(yaml)
+            print(f"Wrote {len(files)} room packs to {args.output}", file=sys.stderr)
+        return 1 if args.strict and conflicts else 0
+
+    result, problems, conflicts, _ = analyze_checked(files[0], args.center, args.offset[0], args.offset[1], args.method, args.dedupe)
+
+    for problem in problems:
+        print(problem, file=sys.stderr)
 
 
     print(f"  size: {result.width},{result.height}")
-    print("  rooms:")
+    print("  rooms:" if len(result.boxes) else "  rooms: []")
 
-    for room in result.rooms:
-        print(f"    - {room.left},{room.bottom},{room.right},{room.top}")
+    for left, bottom, right, top in result.boxes.tolist():
+        print(f"    - {left},{bottom},{right},{top}")
 
     print("")
-    print(f"Generated {len(result.rooms)} rooms.")
+    print(f"Generated {len(result.boxes)} rooms.")
+
+    return 1 if args.strict and conflicts else 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
 
@@ -6,6 +6,9 @@ from typing import List, Any
 import yaml
 import argparse
 import datetime
+import tempfile
+import time
+from changelog_lib import Changelog, NoDatesSafeLoader
 
 MAX_ENTRIES = 500
 
@@ -14,43 +17,102 @@ ENTRY_RE = r"^ *[*-]? *(\S[^\n\r]+)\r?$"
 
 CATEGORY_MAIN = "Main"
 
-# From https://stackoverflow.com/a/37958106/4678631
-class NoDatesSafeLoader(yaml.SafeLoader):
-    @classmethod
-    def remove_implicit_resolver(cls, tag_to_remove):
-        if not 'yaml_implicit_resolvers' in cls.__dict__:
-            cls.yaml_implicit_resolvers = cls.yaml_implicit_resolvers.copy()
-
-        for first_letter, mappings in cls.yaml_implicit_resolvers.items():
-            cls.yaml_implicit_resolvers[first_letter] = [(tag, regexp)
-                                                         for tag, regexp in mappings
-                                                         if tag != tag_to_remove]
-
-# Hrm yes let's make the fucking default of our serialization library to PARSE ISO-8601
-# but then output garbage when re-serializing.
-NoDatesSafeLoader.remove_implicit_resolver('tag:yaml.org,2002:timestamp')
+def read_part(partpath: str) -> Any:
+    with open(partpath, "r", encoding="utf-8-sig") as f:
+        return yaml.load(f, Loader=NoDatesSafeLoader)
+
+def part_entry(partyaml: Any) -> Any:
+    """
+    Turns a changelog part into an entry without an id, or returns None if it has no changes.
+    """
+    author = partyaml["author"]
+    time = partyaml.get(
+        "time", datetime.datetime.now(datetime.timezone.utc).isoformat()
+    )
+    changes = partyaml["changes"]
+    url = partyaml.get("url")
+
+    if not isinstance(changes, list):
+        changes = [changes]
+
+    if not len(changes):
+        # Don't add empty changelog entries...
+        return None
+
+    return {"author": author, "time": time, "changes": changes, "url": url}
+
+# The pure Python loader update_changelog.py used before changelog_lib, as the baseline for --benchmark.
+class PureNoDatesSafeLoader(yaml.SafeLoader):
+    yaml_implicit_resolvers = {
+        first_letter: [(tag, regexp) for tag, regexp in mappings if tag != "tag:yaml.org,2002:timestamp"]
+        for first_letter, mappings in yaml.SafeLoader.yaml_implicit_resolvers.items()
+    }
+
+def benchmark(changelog_file: str, entries: List[Any], runs: int):
+    """
+    Times merging the given entries into the changelog, the old way (pure Python loader, full sort and dump)
+    against the new one, parsing the YAML or loading it from an index. The changelog is not written.
+    """
+    with open(changelog_file, "r", encoding="utf-8-sig") as f:
+        text = f.read()
+
+    def merge_full():
+        data = yaml.load(text, Loader=PureNoDatesSafeLoader)
+        entries_list = data["Entries"] if data is not None else []
+        max_id = max(map(lambda e: e["id"], entries_list), default=0)
+        for entry in entries:
+            max_id += 1
+            entries_list.append(dict(entry, id=max_id))
+        entries_list.sort(key=lambda e: e["id"])
+        new_data = {"Entries": entries_list[max(len(entries_list) - MAX_ENTRIES, 0):]}
+        for key, value in (data or {}).items():
+            if key != "Entries":
+                new_data[key] = value
+        return yaml.safe_dump(new_data)
+
+    def merge_streaming(index_dir=None):
+        changelog = Changelog.parse(text, index_dir)
+        for entry in entries:
+            changelog.add(dict(entry))
+        changelog.trim(MAX_ENTRIES)
+        return changelog.dump()
+
+    index_dir = tempfile.TemporaryDirectory()
+    # Fill the index, so the indexed runs load the parsed changelog from it.
+    Changelog.parse(text, index_dir.name)
+    merge_indexed = lambda: merge_streaming(index_dir.name)
+
+    for name, merge in (("full", merge_full), ("streaming", merge_streaming), ("indexed", merge_indexed)):
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            merge()
+            times.append(time.perf_counter() - start)
+        print(f"{name:>9}: best {min(times) * 1000:.1f} ms, mean {sum(times) / len(times) * 1000:.1f} ms over {runs} runs")
+
+    index_dir.cleanup()
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("changelog_file")
     parser.add_argument("parts_dir")
     parser.add_argument("--category", default=CATEGORY_MAIN)
+    parser.add_argument("--extra-categories", default="", metavar="CATEGORIES",
+                        help="comma separated categories to update in the same run, each in a CATEGORY.yml next to changelog_file")
+    parser.add_argument("--benchmark", type=int, metavar="RUNS",
+                        help="time merging the parts RUNS times, without writing the changelog or removing parts")
 
     args = parser.parse_args()
 
-    category = args.category
-
-    with open(args.changelog_file, "r", encoding="utf-8-sig") as f:
-        current_data = yaml.load(f, Loader=NoDatesSafeLoader)
-
-    entries_list: List[Any]
-    if current_data is None:
-        entries_list = []
-    else:
-        entries_list = current_data["Entries"]
+    changelog_dir = os.path.dirname(args.changelog_file)
+    changelog_files = {args.category: args.changelog_file}
+    for extra in filter(None, args.extra_categories.split(",")):
+        changelog_files[extra] = os.path.join(changelog_dir, f"{extra}.yml")
 
-    max_id = max(map(lambda e: e["id"], entries_list), default=0)
+    new_entries = {category: [] for category in changelog_files}
+    used_parts = {category: [] for category in changelog_files}
 
+    # Every part is read once and routed to the changelog of its category.
     for partname in os.listdir(args.parts_dir):
         if not partname.endswith(".yml"):
             continue
@@ -58,51 +120,41 @@ def main():
         partpath = os.path.join(args.parts_dir, partname)
         print(partpath)
 
-        with open(partpath, "r", encoding="utf-8-sig") as f:
-            partyaml = yaml.load(f, Loader=NoDatesSafeLoader)
+        partyaml = read_part(partpath)
 
         part_category = partyaml.get("category", CATEGORY_MAIN)
-        if part_category != category:
-            print(f"Skipping: wrong category ({part_category} vs {category})")
+        if part_category not in changelog_files:
+            print(f"Skipping: wrong category ({part_category} vs {', '.join(changelog_files)})")
             continue
 
-        author = partyaml["author"]
-        time = partyaml.get(
-            "time", datetime.datetime.now(datetime.timezone.utc).isoformat()
-        )
-        changes = partyaml["changes"]
-        url = partyaml.get("url")
-
-        if not isinstance(changes, list):
-            changes = [changes]
-
-        if len(changes):
-            # Don't add empty changelog entries...
-            max_id += 1
-            new_id = max_id
-
-            entries_list.append(
-                {"author": author, "time": time, "changes": changes, "id": new_id, "url": url}
-            )
+        entry = part_entry(partyaml)
+        if entry is not None:
+            new_entries[part_category].append(entry)
+        used_parts[part_category].append(partpath)
 
-        os.remove(partpath)
+    if args.benchmark:
+        for category, changelog_file in changelog_files.items():
+            print(f"{category} ({changelog_file}, {len(new_entries[category])} new entries):")
+            benchmark(changelog_file, new_entries[category], args.benchmark)
+        return
 
-    print(f"Have {len(entries_list)} changelog entries")
+    for category, changelog_file in changelog_files.items():
+        changelog = Changelog.load(changelog_file)
+        for entry in new_entries[category]:
+            changelog.add(entry)
 
-    entries_list.sort(key=lambda e: e["id"])
+        print(f"Have {len(changelog.entries)} changelog entries in {changelog_file}")
 
-    overflow = len(entries_list) - MAX_ENTRIES
-    if overflow > 0:
-        print(f"Removing {overflow} old entries.")
-        entries_list = entries_list[overflow:]
+        overflow = changelog.trim(MAX_ENTRIES)
+        if overflow > 0:
+            print(f"Removing {overflow} old entries.")
 
-    new_data = {"Entries": entries_list}
-    for key, value in current_data.items():
-        if key != "Entries":
-            new_data[key] = value
+        changelog.save(changelog_file)
 
-    with open(args.changelog_file, "w", encoding="utf-8-sig") as f:
-        yaml.safe_dump(new_data, f)
+        # Remove the parts as soon as their changelog is written, so if writing a later category fails,
+        # running again doesn't add these entries a second time.
+        for partpath in used_parts[category]:
+            os.remove(partpath)
 
 
 main()